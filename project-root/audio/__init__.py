@@ -0,0 +1,7 @@
+from .cache import AudioCache, audio_cache
+from .playlist import import_playlist, is_playlist
+from .queue import QueuePages, Track, TrackQueue
+from .resolver import FFprobeResolver, LocalResolver, TrackResolver, resolver
+from .sources import QUALITY_BITRATES, TrackSource
+from .transcoder import TranscoderManager, TranscoderSlot, transcoder
+from .workers import AudioWorkerPool, PacketRing, audio_workers
\ No newline at end of file
@@ -0,0 +1,179 @@
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Margin over the nominal bitrate for Opus VBR peaks and Ogg framing when sizing a new entry
+ENCODED_SIZE_MARGIN = 1.25
+
+class AudioCache:
+    """Content-addressed on-disk cache of encoded Ogg Opus audio with a byte budget.
+
+    Files are keyed by source URL, encoder bitrate and gain, written to a temporary
+    file and renamed into place, so readers only ever see complete files.
+    A file being written counts against the budget at its expected size, and
+    tracks whose expected size exceeds max_entry_bytes (or is unknown, as for
+    live streams) are not cached at all.
+    Evicting a file unlinks it; readers that already opened or mapped it keep
+    reading their copy until they close it. The files already on disk are
+    indexed by a background thread, so lookups miss them until it is done.
+    """
+
+    def __init__(self, directory, max_bytes, max_entry_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes or max_bytes, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # Encoded bytes served from disk instead of fetched and transcoded
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._size = 0
+        self._reserved = {}  # temp path -> expected size of an encoding being written
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        # Walking a large cache directory would hold up the import (and the event loop loading the cogs)
+        threading.Thread(target=self._scan, name="audio-cache-scan", daemon=True).start()
+
+    def _scan(self):
+        """Indexes the files already on disk, oldest access first (runs in its own thread)."""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name.endswith(".part"):
+                        if time.time() - os.path.getmtime(path) > 3600:
+                            os.unlink(path)  # Left behind by a writer that never finished
+                        continue
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Committed or evicted meanwhile
+                found.append((stat.st_atime, name[:-len(".opus")], stat.st_size))
+        with self._lock:
+            # Files committed since the scan started were used most recently, so they stay at the end
+            entries = OrderedDict((key, size) for _, key, size in sorted(found) if key not in self._entries)
+            self._size += sum(entries.values())
+            entries.update(self._entries)
+            self._entries = entries
+            self._evict()
+
+    @staticmethod
+    def key(url, bitrate, gain=1.0):
+        # Unity gain keeps the original key format, so files cached before gains were keyed still hit
+        name = f"{bitrate}\0{url}" if gain == 1.0 else f"{bitrate}\0{gain:.3f}\0{url}"
+        return hashlib.sha256(name.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.opus")
+
+    def lookup(self, url, bitrate, gain=1.0):
+        """Returns the path of the cached encoding, or None on a miss."""
+        key = self.key(url, bitrate, gain)
+        with self._lock:
+            size = self._entries.get(key)
+            if size is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += size
+        path = self._path(key)
+        try:
+            # Off the event loop: a metadata write can stall on a slow disk
+            asyncio.get_running_loop().run_in_executor(None, self._touch, path)
+        except RuntimeError:  # Not called from the event loop
+            self._touch(path)
+        return path
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)  # Keeps the on-disk order right for the next restart's scan
+        except OSError:
+            pass
+
+    def reserve(self, url, bitrate, duration, gain=1.0):
+        """Returns a temporary path to write a new encoding to before commit(), or None if it should not be cached.
+
+        duration is the track length in seconds; None (unknown) is never cached,
+        and neither is silence (gain 0).
+        """
+        if duration is None or not gain:
+            return None
+        expected = int(duration * bitrate * 125 * ENCODED_SIZE_MARGIN)  # kbps -> bytes per second
+        if expected > self.max_entry_bytes:
+            return None
+        path = self._path(self.key(url, bitrate, gain))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(path))
+        os.close(fd)
+        with self._lock:
+            self._reserved[temp_path] = expected
+            self._evict()  # Make room for it now rather than overshooting while it is written
+        return temp_path
+
+    def commit(self, url, bitrate, temp_path, gain=1.0):
+        """Atomically moves a finished encoding into the cache and evicts down to the budget."""
+        key = self.key(url, bitrate, gain)
+        try:
+            size = os.path.getsize(temp_path)
+            if size > self.max_entry_bytes:
+                # Longer than its reported duration; the cache never holds such files
+                self.discard(temp_path)
+                return
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            logging.error(f"Error caching audio for {url}: {e}")
+            self.discard(temp_path)
+            return
+        with self._lock:
+            self._reserved.pop(temp_path, None)
+            self._size += size - self._entries.get(key, 0)
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def discard(self, temp_path):
+        """Removes an unfinished encoding."""
+        with self._lock:
+            self._reserved.pop(temp_path, None)
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        reserved = sum(self._reserved.values())
+        while self._size + reserved > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Returns the cache counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "writing": len(self._reserved),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+        }
+
+# Shared by every player; AUDIO_CACHE_MAX_BYTES=0 disables the cache
+_max_bytes = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(1024 ** 3)))
+audio_cache = AudioCache(
+    os.getenv("AUDIO_CACHE_DIR", "audio_cache"),
+    _max_bytes,
+    max_entry_bytes=int(os.getenv("AUDIO_CACHE_MAX_ENTRY_BYTES", str(_max_bytes // 10))),
+) if _max_bytes > 0 else None
@@ -0,0 +1,112 @@
+import os
+import asyncio
+import contextlib
+from urllib.parse import urljoin
+
+import requests
+
+from .queue import Track
+
+PLAYLIST_EXTENSIONS = (".m3u", ".m3u8", ".pls")
+
+# Directory local playlist files may be read from; unset, only http(s) playlists are accepted
+PLAYLIST_DIR = os.getenv("PLAYLIST_DIR")
+
+def is_playlist(source):
+    """Returns True if a play request names a playlist rather than a single track."""
+    return source.split("?", 1)[0].lower().endswith(PLAYLIST_EXTENSIONS)
+
+def _local_path(source):
+    """Returns the path of a playlist file inside PLAYLIST_DIR; raises ValueError for any other file."""
+    if not PLAYLIST_DIR:
+        raise ValueError("only http(s) playlist URLs are accepted")
+    root = os.path.realpath(PLAYLIST_DIR)
+    path = os.path.realpath(os.path.join(root, source))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError("playlist is not in the playlist directory")
+    return path
+
+def _fetch_lines(source):
+    """Reads a playlist from a URL or a file in PLAYLIST_DIR (blocking)."""
+    if source.startswith(("http://", "https://")):
+        response = requests.get(source, timeout=10)
+        response.raise_for_status()
+        return response.text.splitlines()
+    with open(_local_path(source), encoding="utf-8", errors="replace") as f:
+        return f.read().splitlines()
+
+async def playlist_entries(source, max_entries=None):
+    """Yields the track URLs of an M3U or PLS playlist in order."""
+    lines = await asyncio.get_running_loop().run_in_executor(None, _fetch_lines, source)
+    count = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(("#", "[")):
+            continue
+        if "=" in line and line.lower().startswith("file"):
+            line = line.split("=", 1)[1].strip()  # PLS: File1=https://...
+        elif "=" in line and not line.startswith(("http://", "https://")):
+            continue  # Other PLS keys (Title1=, Length1=, NumberOfEntries=)
+        if source.startswith(("http://", "https://")):
+            line = urljoin(source, line)
+            if not line.startswith(("http://", "https://")):
+                continue  # A remote playlist may not point the bot at local files (file:// and the like)
+        yield line
+        count += 1
+        if max_entries is not None and count >= max_entries:
+            return
+
+async def resolve_batches(urls, resolver, requester_id=None, batch_size=25):
+    """Groups URLs into batches and yields each batch as resolved Tracks.
+
+    The first batch holds a single track so playback can start as soon as it
+    resolves; the rest are resolved batch_size at a time.
+    """
+    batch = []
+    limit = 1
+    async for url in urls:
+        batch.append(Track(url, requester_id=requester_id))
+        if len(batch) >= limit:
+            await resolver.apply(batch)
+            yield batch
+            batch = []
+            limit = batch_size
+    if batch:
+        await resolver.apply(batch)
+        yield batch
+
+async def buffered(items, max_pending):
+    """Runs an async generator ahead of its consumer by at most max_pending items.
+
+    The producer blocks once the buffer is full, so a slow consumer holds the
+    whole pipeline back instead of letting work pile up in memory.
+    """
+    buffer = asyncio.Queue(maxsize=max_pending)
+    done = object()
+
+    async def produce():
+        # Not in a finally: once cancelled, nobody reads the buffer and a put could block forever
+        try:
+            async with contextlib.aclosing(items):
+                async for item in items:
+                    await buffer.put(item)
+        except Exception as e:
+            await buffer.put(e)
+        await buffer.put(done)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
+def import_playlist(source, resolver, requester_id=None, max_entries=None, batch_size=25, max_pending=4):
+    """Returns an async generator of resolved Track batches for a playlist."""
+    urls = playlist_entries(source, max_entries)
+    return buffered(resolve_batches(urls, resolver, requester_id, batch_size), max_pending)
@@ -0,0 +1,204 @@
+import random
+import sys
+
+class Track:
+    """One queued song."""
+
+    __slots__ = ("url", "title", "duration", "requester_id")
+
+    def __init__(self, url, title=None, duration=None, requester_id=None):
+        self.url = url
+        self.title = title
+        self.duration = duration  # Seconds, if known
+        self.requester_id = requester_id
+
+    def __str__(self):
+        return self.title or self.url
+
+    def __repr__(self):
+        return f"Track({self.url!r})"
+
+    def to_state(self):
+        """Returns the track as a compact JSON-serializable list."""
+        return [self.url, self.title, self.duration, self.requester_id]
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(*state)
+
+    def approx_bytes(self):
+        """Approximate memory held by the track and its strings."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.url)
+        if self.title is not None:
+            size += sys.getsizeof(self.title)
+        return size
+
+class TrackQueue:
+    """Playback queue with O(1) dequeue and O(1) indexed reads.
+
+    Tracks live in a list after a moving head index: popping the next track
+    just advances the head, and the dead prefix is dropped in one slice once
+    it outgrows the live part, so dequeue is amortized O(1). Indexed
+    removal and moves are single C-level memmoves. ``version`` changes on
+    every mutation so views of the queue can tell when to re-render.
+    """
+
+    # Dead prefix length below which compaction is not worth a slice
+    _COMPACT_MIN = 1024
+
+    def __init__(self, tracks=()):
+        self._items = list(tracks)
+        self._head = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._items) - self._head
+
+    def __bool__(self):
+        return len(self._items) > self._head
+
+    def __iter__(self):
+        for i in range(self._head, len(self._items)):
+            yield self._items[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self._items[self._head + start:self._head + stop:step]
+        return self._items[self._head + self._index(index)]
+
+    def approx_bytes(self):
+        """Approximate memory held by the queue, including its tracks."""
+        return sys.getsizeof(self._items) + sum(track.approx_bytes() for track in self)
+
+    def _index(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("queue index out of range")
+        return index
+
+    def _changed(self):
+        self.version += 1
+
+    def append(self, track):
+        self._items.append(track)
+        self._changed()
+
+    def extend(self, tracks):
+        """Appends many tracks at once."""
+        self._items.extend(tracks)
+        self._changed()
+
+    def popleft(self):
+        """Removes and returns the next track."""
+        if self._head >= len(self._items):
+            raise IndexError("pop from an empty queue")
+        track = self._items[self._head]
+        self._items[self._head] = None  # Drop the reference now rather than at compaction
+        self._head += 1
+        if self._head >= self._COMPACT_MIN and self._head * 2 >= len(self._items):
+            del self._items[:self._head]
+            self._head = 0
+        self._changed()
+        return track
+
+    def appendleft(self, track):
+        """Puts a track back at the front of the queue."""
+        if self._head > 0:
+            self._head -= 1
+            self._items[self._head] = track
+        else:
+            self._items.insert(0, track)
+        self._changed()
+
+    def pop(self, index=-1):
+        """Removes and returns the track at index."""
+        index = self._index(index)
+        if index == 0:
+            return self.popleft()
+        track = self._items.pop(self._head + index)
+        self._changed()
+        return track
+
+    def move(self, source, destination):
+        """Moves the track at source to destination."""
+        track = self.pop(source)
+        destination = min(max(destination, 0), len(self))
+        self._items.insert(self._head + destination, track)
+        self._changed()
+        return track
+
+    def clear(self):
+        self._items = []
+        self._head = 0
+        self._changed()
+
+    def shuffle(self):
+        """Shuffles the queue in place in O(n)."""
+        live = self._items[self._head:]
+        random.shuffle(live)
+        self._items = live
+        self._head = 0
+        self._changed()
+
+    def dedupe(self):
+        """Drops every track whose URL appeared earlier in the queue; returns how many were removed."""
+        seen = set()
+        live = []
+        for track in self:
+            if track.url not in seen:
+                seen.add(track.url)
+                live.append(track)
+        removed = len(self) - len(live)
+        self._items = live
+        self._head = 0
+        self._changed()
+        return removed
+
+class QueuePages:
+    """Renders one page of a TrackQueue at a time.
+
+    A page costs O(page_size): it is sliced straight out of the queue at its
+    offset, and rendered pages are reused until the queue's version changes.
+    """
+
+    # Longest title/URL shown per entry, so a full page stays under Discord's 2000 characters
+    ENTRY_WIDTH = 150
+    # Rendered pages kept per queue version
+    MAX_CACHED_PAGES = 16
+
+    def __init__(self, queue, page_size=10):
+        self.queue = queue
+        self.page_size = page_size
+        self._version = None
+        self._pages = {}
+
+    def page_count(self):
+        return max(1, -(-len(self.queue) // self.page_size))
+
+    def page_of(self, index):
+        """Returns the 1-based page that holds the given queue index."""
+        return index // self.page_size + 1
+
+    def render(self, page):
+        """Returns the text of a 1-based page, clamped to the pages that exist."""
+        if self._version != self.queue.version:
+            self._pages.clear()
+            self._version = self.queue.version
+        page = min(max(page, 1), self.page_count())
+        text = self._pages.get(page)
+        if text is None:
+            start = (page - 1) * self.page_size
+            lines = [f"Queue ({len(self.queue)} songs), page {page}/{self.page_count()}:"]
+            for index, track in enumerate(self.queue[start:start + self.page_size], start):
+                entry = str(track)
+                if len(entry) > self.ENTRY_WIDTH:
+                    entry = entry[:self.ENTRY_WIDTH - 1] + "…"
+                lines.append(f"`{index}` {entry}")
+            text = "\n".join(lines)
+            if len(self._pages) >= self.MAX_CACHED_PAGES:
+                self._pages.clear()
+            self._pages[page] = text
+        return text
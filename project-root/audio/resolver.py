@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a link was shared from
+_TRACKING_PARAMS = {"si", "feature", "fbclid", "gclid"}
+
+class LocalResolver:
+    """Stand-in resolver that derives metadata from the URL itself, without any I/O."""
+
+    async def resolve(self, url):
+        path = urlsplit(url).path.rstrip("/")
+        name = path.rsplit("/", 1)[-1] if path else url
+        return {"title": name.rsplit(".", 1)[0] or url, "duration": None}
+
+class FFprobeResolver:
+    """Reads the title and duration of a media URL with ffprobe."""
+
+    async def resolve(self, url):
+        # The URL comes from a user; anything else could reach ffprobe as an option or a protocol
+        if not url.startswith(("http://", "https://")) and not os.path.isfile(url):
+            raise ValueError("not an http(s) URL or a file")
+        process = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-i", url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            output, _ = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(f"ffprobe exited with {process.returncode}")
+        media_format = json.loads(output or b"{}").get("format", {})
+        tags = {key.lower(): value for key, value in media_format.get("tags", {}).items()}
+        duration = media_format.get("duration")
+        return {
+            "title": tags.get("title"),
+            "duration": float(duration) if duration else None,
+        }
+
+class TrackResolver:
+    """Resolves track metadata once per URL per TTL, shared by every guild.
+
+    Results are cached in memory and in a local SQLite file keyed by the
+    normalized URL. Concurrent requests for the same URL share one lookup,
+    and at most ``concurrency`` lookups run against the backend at a time.
+    """
+
+    # Failed lookups are retried after this many seconds
+    FAILURE_TTL = 60
+
+    def __init__(self, backend, concurrency=4, ttl=3600, timeout=10, store_path=None, max_entries=10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.timeout = timeout
+        self.store_path = store_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (expires_at, info or None)
+        self._inflight = {}  # key -> future shared by concurrent callers
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._store = None
+
+    @staticmethod
+    def normalize(url):
+        """Canonical form of a URL used as the cache key."""
+        url = url.strip()
+        parts = urlsplit(url)
+        if not parts.scheme or not parts.netloc:
+            return url
+        query = sorted((key, value) for key, value in parse_qsl(parts.query) if key not in _TRACKING_PARAMS and not key.startswith("utm_"))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+    def _connect_store(self):
+        if self._store is None:
+            self._store = sqlite3.connect(self.store_path, check_same_thread=False)
+            self._store.execute(
+                "CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, info TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        return self._store
+
+    def _read_store(self, keys):
+        """Returns {key: info} for the keys with an unexpired entry in the SQLite store (blocking)."""
+        store = self._connect_store()
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = store.execute(
+                f"SELECT key, info FROM tracks WHERE expires_at > ? AND key IN ({', '.join('?' * len(batch))})",
+                (time.time(), *batch),
+            )
+            found.update((key, json.loads(info)) for key, info in rows)
+        return found
+
+    def _write_store(self, entries):
+        """Saves {key: info} to the SQLite store (blocking)."""
+        store = self._connect_store()
+        expires_at = time.time() + self.ttl
+        with store:
+            store.executemany(
+                "INSERT OR REPLACE INTO tracks (key, info, expires_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(info), expires_at) for key, info in entries.items()],
+            )
+
+    def _remember(self, key, info):
+        ttl = self.ttl if info is not None else self.FAILURE_TTL
+        self._memory[key] = (time.monotonic() + ttl, info)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _recall(self, key):
+        """Returns (found, info) from the in-memory cache."""
+        entry = self._memory.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return False, None
+        self._memory.move_to_end(key)
+        return True, entry[1]
+
+    async def resolve(self, url):
+        """Returns the metadata for one URL, or None if it could not be resolved."""
+        return (await self.resolve_many([url]))[0]
+
+    async def resolve_many(self, urls):
+        """Resolves a batch of URLs (e.g. a playlist); returns their metadata in order."""
+        keys = [self.normalize(url) for url in urls]
+        results = {}
+        pending = {}  # key -> lookup future, taken now since a lookup leaves _inflight once it finishes
+        missing = []
+        for key in dict.fromkeys(keys):
+            found, info = self._recall(key)
+            if found:
+                self.hits += 1
+                results[key] = info
+            elif key in self._inflight:
+                pending[key] = self._inflight[key]
+            else:
+                missing.append(key)
+
+        # One bulk read of the persistent store for everything not in memory
+        if missing and self.store_path:
+            loop = asyncio.get_running_loop()
+            try:
+                stored = await loop.run_in_executor(None, self._read_store, missing)
+            except sqlite3.Error as e:
+                logging.error(f"Error reading track metadata cache: {e}")
+                stored = {}
+            for key, info in stored.items():
+                self.hits += 1
+                self._remember(key, info)
+                results[key] = info
+            missing = [key for key in missing if key not in stored]
+
+        original_urls = dict(zip(keys, urls))
+        for key in missing:
+            if key not in self._inflight:
+                self.misses += 1
+                self._inflight[key] = asyncio.ensure_future(self._lookup(key, original_urls[key]))
+            pending[key] = self._inflight[key]
+        if pending:
+            # Shielded: the lookups are shared, so one cancelled caller must not cancel them for the others
+            lookups = [asyncio.shield(future) for future in pending.values()]
+            for key, info in zip(pending, await asyncio.gather(*lookups)):
+                results[key] = info
+        return [results[key] for key in keys]
+
+    async def _lookup(self, key, url):
+        try:
+            async with self._semaphore:
+                info = await asyncio.wait_for(self.backend.resolve(url), self.timeout)
+        except Exception as e:
+            logging.error(f"Error resolving {url}: {e}")
+            info = None
+        finally:
+            self._inflight.pop(key, None)
+        self._remember(key, info)
+        if info is not None and self.store_path:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write_store, {key: info})
+            except sqlite3.Error as e:
+                logging.error(f"Error saving track metadata: {e}")
+        return info
+
+    async def apply(self, tracks):
+        """Fills in the title and duration of a batch of Track objects."""
+        for track, info in zip(tracks, await self.resolve_many([track.url for track in tracks])):
+            if info:
+                track.title = info.get("title") or track.title
+                track.duration = info.get("duration") or track.duration
+
+    def stats(self):
+        """Returns the resolver counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "in_flight": len(self._inflight),
+        }
+
+_BACKENDS = {"ffprobe": FFprobeResolver, "local": LocalResolver}
+
+# Shared by every player; TRACK_RESOLVER=local skips all network lookups
+resolver = TrackResolver(
+    _BACKENDS[os.getenv("TRACK_RESOLVER", "ffprobe").lower()](),
+    concurrency=int(os.getenv("TRACK_RESOLVER_CONCURRENCY", "4")),
+    ttl=float(os.getenv("TRACK_RESOLVER_TTL", "3600")),
+    store_path=os.getenv("TRACK_RESOLVER_CACHE", "track_cache.sqlite3") or None,
+)
@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import mmap
+import shlex
+import subprocess
+import threading
+import time
+from collections import deque
+
+import discord
+from discord.oggparse import OggStream
+
+from .workers import OPUS_HEADERS, WorkerStream
+
+# Opus encoder bitrate (kbps) for each playback quality
+QUALITY_BITRATES = {"high": 128, "medium": 96, "low": 64}
+
+# discord.py reads one 20 ms Opus packet per call to AudioSource.read()
+FRAME_SECONDS = 0.02
+
+# Keeps idle or slow network inputs (e.g. a pre-started next track) from dropping
+HTTP_RECONNECT_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+
+def encoder_args(source, *, bitrate=128, volume=1.0, before_options=None, copy_to=None):
+    """FFmpeg arguments that encode source to Ogg Opus on stdout (and, with copy_to, also to that file)."""
+    encode = ["-f", "opus", "-c:a", "libopus", "-ar", "48000", "-ac", "2", "-b:a", f"{bitrate}k"]
+    args = [*shlex.split(before_options or ""), "-i", source, "-map_metadata", "-1", "-loglevel", "warning", "-map", "0:a:0"]
+    if volume != 1.0:
+        args += ["-filter:a", f"volume={volume:.3f}"]
+    if copy_to is not None:
+        # One encode, written to both the cache file and stdout
+        return args + [*encode[2:], "-f", "tee", f"[f=opus]{copy_to}|[f=opus]pipe:1"]
+    return args + [*encode, "pipe:1"]
+
+class OpusEncoder(discord.FFmpegAudio):
+    """FFmpeg process encoding one input to Ogg Opus on stdout.
+
+    With copy_to, the same encoding is also written to that file, which is
+    how tracks get into the on-disk cache. on_complete is
+    called on cleanup with whether FFmpeg finished the whole input. A
+    TranscoderSlot, if given, is attached to the process and released on cleanup.
+    """
+
+    def __init__(self, source, *, bitrate=128, volume=1.0, before_options=None, copy_to=None, slot=None):
+        args = encoder_args(source, bitrate=bitrate, volume=volume, before_options=before_options, copy_to=copy_to)
+        super().__init__(source, executable="ffmpeg", args=args, stdin=subprocess.DEVNULL)
+        self.slot = slot
+        if slot is not None:
+            slot.attach(self._process)
+        self._packet_iter = OggStream(self._stdout).iter_packets()
+        self._exhausted = False
+        self.on_complete = None
+
+    def is_opus(self):
+        return True
+
+    def read(self):
+        data = next(self._packet_iter, b"")
+        if not data:
+            self._exhausted = True
+        return data
+
+    def cleanup(self):
+        completed = False
+        process = self._process
+        if self._exhausted and process:
+            try:
+                completed = process.wait(timeout=5) == 0
+            except subprocess.TimeoutExpired:
+                pass
+        super().cleanup()
+        if self.slot is not None:
+            self.slot.release()
+        if self.on_complete is not None:
+            on_complete, self.on_complete = self.on_complete, None
+            on_complete(completed)
+
+class MappedOpusReader:
+    """Reads Opus packets straight from a memory-mapped Ogg Opus file, without FFmpeg."""
+
+    def __init__(self, path, skip_frames=0):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._packet_iter = OggStream(self._map).iter_packets()
+        for _ in range(skip_frames):
+            if not TrackSource._read_audio(self):
+                break
+
+    def read(self):
+        try:
+            return next(self._packet_iter, b"")
+        except ValueError:  # Mapping closed by cleanup()
+            return b""
+
+    def cleanup(self):
+        self._map.close()
+
+class TrackSource(discord.AudioSource):
+    """Opus source for one track whose gain is applied by the FFmpeg encoder.
+
+    Nothing is scaled in Python per frame. A volume change starts a second
+    encoder at the current position with the new gain, primes it off the
+    player thread, and swaps it in at a frame boundary once it has caught up.
+
+    With an AudioCache, tracks are cached at the gain they were played at. A
+    hit at that gain is read from a memory map with no FFmpeg at all, other
+    gains re-encode the local file, and a miss played from the start is
+    written to the cache as it streams, if its
+    duration (seconds) is known and small enough for the cache to take.
+
+    slot is the TranscoderSlot the first encoder runs under; it is released at
+    once if the track is served from the memory map instead. With an
+    AudioWorkerPool, encoders run in its worker processes and packets arrive
+    over shared memory instead of being demuxed on the player thread.
+    """
+
+    def __init__(self, url, bitrate=128, volume=1.0, start=0.0, cache=None, slot=None, workers=None, duration=None):
+        self.url = url
+        self.duration = duration
+        self.bitrate = bitrate
+        self.volume = volume
+        self.cache = cache
+        self.workers = workers
+        self.cached_path = cache.lookup(url, bitrate, volume) if cache is not None else None
+        self.cached_gain = volume  # Gain the cached file was encoded at
+        self.frames = round(start / FRAME_SECONDS)  # Packets played so far, including the seek offset
+        self.manager = slot.manager if slot is not None else None
+        self.guild_id = slot.guild_id if slot is not None else None
+        try:
+            self._source = self._open(volume, start, slot)
+        except Exception:
+            if slot is not None:
+                slot.release()
+            raise
+        if slot is not None and not isinstance(self._source, (OpusEncoder, WorkerStream)):
+            slot.release()
+        self._buffer = deque()  # Packets already read from the current encoder
+        self._lock = threading.Lock()
+        self._finished = False
+        self.on_start = None  # Called from the player thread with the time the first packet is read
+        self.started_at = None
+        self.ended_at = None
+
+    def _open(self, volume, start, slot=None):
+        if self.cached_path is not None:
+            try:
+                if volume == self.cached_gain:
+                    return MappedOpusReader(self.cached_path, skip_frames=round(start / FRAME_SECONDS))
+                return self._encode(
+                    self.cached_path,
+                    volume=volume / self.cached_gain,
+                    before_options=f"-ss {start:.2f}" if start else None,
+                    slot=slot,
+                )
+            except (OSError, ValueError, discord.ClientException) as e:
+                # Evicted since the lookup, or unreadable; fall back to the original source
+                logging.error(f"Error reading cached audio for {self.url}: {e}")
+                self.cached_path = None
+
+        before_options = []
+        if self.url.startswith(("http://", "https://")):
+            before_options.append(HTTP_RECONNECT_OPTIONS)
+        if start:
+            before_options.append(f"-ss {start:.2f}")
+        copy_to = self.cache.reserve(self.url, self.bitrate, self.duration, volume) if self.cache is not None and not start else None
+        try:
+            encoder = self._encode(
+                self.url,
+                volume=volume,
+                before_options=" ".join(before_options) or None,
+                copy_to=copy_to,
+                slot=slot,
+            )
+        except Exception:
+            if copy_to is not None:
+                self.cache.discard(copy_to)
+            raise
+        if copy_to is not None:
+            encoder.on_complete = lambda completed: (
+                self.cache.commit(self.url, self.bitrate, copy_to, volume) if completed else self.cache.discard(copy_to)
+            )
+        return encoder
+
+    def _encode(self, source, *, volume, before_options=None, copy_to=None, slot=None):
+        """Starts an encoder, in an audio worker process when a pool is configured."""
+        if self.workers is not None:
+            args = encoder_args(
+                source, bitrate=self.bitrate, volume=volume, before_options=before_options, copy_to=copy_to
+            )
+            return self.workers.open(args, slot=slot)
+        return OpusEncoder(
+            source, bitrate=self.bitrate, volume=volume, before_options=before_options, copy_to=copy_to, slot=slot
+        )
+
+    @staticmethod
+    def _read_audio(source):
+        """Reads the next audio packet from an encoder, skipping the Ogg Opus headers."""
+        data = source.read()
+        while data.startswith(OPUS_HEADERS):
+            data = source.read()
+        return data
+
+    @property
+    def position(self):
+        """Seconds of the track played so far."""
+        return self.frames * FRAME_SECONDS
+
+    def is_opus(self):
+        return True
+
+    def prime(self):
+        """Starts the encoder and buffers the first packet so playback can begin instantly (blocking)."""
+        with self._lock:
+            if not self._buffer:
+                data = self._read_audio(self._source)
+                if data:
+                    self._buffer.append(data)
+        return bool(self._buffer)
+
+    def read(self):
+        with self._lock:
+            data = self._buffer.popleft() if self._buffer else self._read_audio(self._source)
+        if data:
+            if self.started_at is None:
+                self.started_at = time.perf_counter()
+                if self.on_start is not None:
+                    self.on_start(self.started_at)
+            self.frames += 1
+        else:
+            self._finished = True
+            if self.ended_at is None:
+                self.ended_at = time.perf_counter()
+        return data
+
+    def cleanup(self):
+        # Not under the lock: killing FFmpeg is what unblocks a read waiting on it
+        self._finished = True
+        self._source.cleanup()
+
+    async def set_volume(self, volume, timeout=5.0):
+        """Switches to an encoder with the new gain; raises asyncio.TimeoutError if it does not start in time."""
+        cancelled = threading.Event()
+        started = []  # The replacement encoder, once spawned
+        try:
+            await asyncio.wait_for(self._switch_volume(volume, cancelled, started), timeout)
+        except BaseException:
+            cancelled.set()
+            if started and self._source is not started[0]:
+                started[0].cleanup()  # Unblocks the priming thread if it is still waiting on FFmpeg
+            raise
+        self.volume = volume
+
+    async def _switch_volume(self, volume, cancelled, started):
+        slot = await self.manager.acquire(self.guild_id) if self.manager is not None else None
+        frames = self.frames
+        try:
+            replacement = self._open(volume, frames * FRAME_SECONDS, slot)
+        except Exception:
+            if slot is not None:
+                slot.release()
+            raise
+        if slot is not None and not isinstance(replacement, (OpusEncoder, WorkerStream)):
+            slot.release()
+        started.append(replacement)
+        await asyncio.get_running_loop().run_in_executor(None, self._swap_in, replacement, frames, cancelled)
+
+    def _swap_in(self, replacement, frames, cancelled):
+        """Primes the replacement encoder and swaps it in once it has caught up (runs in an executor)."""
+        buffered = deque()
+        data = self._read_audio(replacement)
+        while data and frames < self.frames and not cancelled.is_set():
+            # Drop the packets the current encoder played while this one was starting
+            data = replacement.read()
+            frames += 1
+        if not data or cancelled.is_set() or self._finished:
+            replacement.cleanup()
+            return
+        buffered.append(data)
+        with self._lock:
+            if cancelled.is_set():
+                replacement.cleanup()
+                return
+            # Catch up the frame or two read since the loop above finished
+            while frames < self.frames and buffered:
+                buffered.popleft()
+                frames += 1
+                if not buffered:
+                    data = replacement.read()
+                    if data:
+                        buffered.append(data)
+            previous, self._source = self._source, replacement
+            self._buffer = buffered
+        previous.cleanup()
@@ -0,0 +1,179 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict, deque
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+class TranscoderSlot:
+    """Permission to run one FFmpeg process, held until release().
+
+    A holder that could give the slot up (e.g. a song decoded ahead of time)
+    sets reclaim to a callable; when another guild has to wait for a slot, the
+    manager calls it on the event loop, and it returns True if it released one.
+    """
+
+    __slots__ = ("manager", "guild_id", "process", "released", "reclaim")
+
+    def __init__(self, manager, guild_id):
+        self.manager = manager
+        self.guild_id = guild_id
+        self.process = None
+        self.released = False
+        self.reclaim = None
+
+    def attach(self, process):
+        """Records the process started under this slot for accounting and cleanup."""
+        self.process = process
+
+    def release(self):
+        self.manager.release(self)
+
+class TranscoderManager:
+    """Process-wide cap on concurrent FFmpeg processes with fair queuing across guilds.
+
+    Waiting guilds are served round-robin, one slot per guild per turn, so a
+    guild importing a playlist cannot starve the others. Slots are released
+    from any thread (players clean up on their own threads), and exited
+    processes are reaped whenever a slot is requested. A guild that has to
+    wait first asks one reclaimable slot (see TranscoderSlot) to be given back.
+    """
+
+    def __init__(self, max_processes):
+        self.max_processes = max_processes
+        self._active = set()  # Slots currently held
+        self._waiters = OrderedDict()  # guild_id -> deque of (future, loop), served round-robin
+        self._lock = threading.Lock()
+
+    def try_acquire(self, guild_id):
+        """Returns a slot if one is free right now, otherwise None."""
+        with self._lock:
+            self._reap_locked()
+            if len(self._active) < self.max_processes and not self._waiters:
+                return self._grant_locked(guild_id)
+        return None
+
+    async def acquire(self, guild_id, timeout=None):
+        """Waits for a slot, queued fairly behind other guilds; raises asyncio.TimeoutError after timeout seconds."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._reap_locked()
+            if len(self._active) < self.max_processes and not self._waiters:
+                return self._grant_locked(guild_id)
+            future = loop.create_future()
+            self._waiters.setdefault(guild_id, deque()).append((future, loop))
+            reclaimable = [slot for slot in self._active if slot.reclaim is not None]
+        # Outside the lock: giving a slot back releases it, which takes the lock
+        for slot in reclaimable:
+            reclaim, slot.reclaim = slot.reclaim, None
+            if reclaim is not None and reclaim():
+                break
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            with self._lock:
+                queue = self._waiters.get(guild_id)
+                if queue is not None:
+                    try:
+                        queue.remove((future, loop))
+                    except ValueError:
+                        pass
+                    if not queue:
+                        del self._waiters[guild_id]
+            if future.done() and not future.cancelled():
+                future.result().release()  # Granted just as the wait ended
+            raise
+
+    def release(self, slot):
+        with self._lock:
+            if slot.released:
+                return
+            slot.released = True
+            self._active.discard(slot)
+            self._grant_waiters_locked()
+
+    def kill_guild(self, guild_id):
+        """Kills every FFmpeg process running for a guild and frees their slots."""
+        with self._lock:
+            slots = [slot for slot in self._active if slot.guild_id == guild_id]
+        for slot in slots:
+            if slot.process is not None and slot.process.poll() is None:
+                try:
+                    slot.process.kill()
+                except OSError:
+                    pass
+        with self._lock:
+            self._reap_locked()
+
+    def _grant_locked(self, guild_id):
+        slot = TranscoderSlot(self, guild_id)
+        self._active.add(slot)
+        return slot
+
+    def _grant_waiters_locked(self):
+        while self._waiters and len(self._active) < self.max_processes:
+            guild_id, queue = next(iter(self._waiters.items()))
+            future, loop = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(guild_id)
+            else:
+                del self._waiters[guild_id]
+            if future.done():
+                continue  # Cancelled while waiting
+            loop.call_soon_threadsafe(self._resolve, future, self._grant_locked(guild_id))
+
+    @staticmethod
+    def _resolve(future, slot):
+        if future.done():
+            slot.release()
+        else:
+            future.set_result(slot)
+
+    def _reap_locked(self):
+        """Frees the slots of processes that have exited (poll() also reaps zombies)."""
+        exited = [slot for slot in self._active if slot.process is not None and slot.process.poll() is not None]
+        for slot in exited:
+            slot.released = True
+            self._active.discard(slot)
+        if exited:
+            self._grant_waiters_locked()
+
+    @staticmethod
+    def _usage(pid):
+        """Returns (cpu_seconds, rss_bytes) for a process from /proc, or (0.0, 0) where unavailable."""
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return 0.0, 0
+        # utime and stime are fields 14 and 15 of stat, i.e. 11 and 12 after the command name
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS, rss_pages * _PAGE_SIZE
+
+    def stats(self):
+        """Returns process counts and per-guild CPU/RSS usage."""
+        with self._lock:
+            self._reap_locked()
+            active = list(self._active)
+            waiting = sum(len(queue) for queue in self._waiters.values())
+        guilds = {}
+        for slot in active:
+            usage = guilds.setdefault(slot.guild_id, {"processes": 0, "cpu_seconds": 0.0, "rss_bytes": 0})
+            usage["processes"] += 1
+            if slot.process is not None:
+                cpu_seconds, rss_bytes = self._usage(slot.process.pid)
+                usage["cpu_seconds"] += cpu_seconds
+                usage["rss_bytes"] += rss_bytes
+        return {
+            "max_processes": self.max_processes,
+            "active": len(active),
+            "waiting": waiting,
+            "cpu_seconds": sum(usage["cpu_seconds"] for usage in guilds.values()),
+            "rss_bytes": sum(usage["rss_bytes"] for usage in guilds.values()),
+            "guilds": guilds,
+        }
+
+# Shared by every player in the process
+transcoder = TranscoderManager(int(os.getenv("FFMPEG_MAX_PROCESSES", str(2 * (os.cpu_count() or 1)))))
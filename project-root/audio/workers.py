@@ -0,0 +1,349 @@
+"""Audio worker processes that run FFmpeg and demux its Ogg output off the bot process.
+
+Each worker is this file run as a script, reading one JSON job per line on
+stdin. A job names a shared-memory PacketRing the bot created; the worker
+starts FFmpeg, splits its Ogg Opus output into packets and writes them to the
+ring, where the bot's player thread picks them up with a memory copy. The
+file only needs the standard library and discord.oggparse, so workers start
+without importing the rest of the bot.
+"""
+import os
+import sys
+import json
+import atexit
+import time
+import struct
+import logging
+import threading
+import subprocess
+from multiprocessing import resource_tracker, shared_memory
+
+from discord.oggparse import OggStream
+
+# Ogg Opus header packets; they carry no audio and must not be sent to Discord
+OPUS_HEADERS = (b"OpusHead", b"OpusTags")
+
+_U64 = struct.Struct("<Q")
+_I32 = struct.Struct("<i")
+_LENGTH = struct.Struct("<I")
+
+class PacketRing:
+    """Single-producer, single-consumer ring of length-prefixed packets in shared memory.
+
+    The header holds ever-increasing write and read offsets, each written by
+    one side only, plus the producer's done flag, FFmpeg's return code and pid,
+    and the consumer's cancel flag. The producer copies a packet in before it
+    advances the write offset, so the consumer never sees a partial packet.
+    """
+
+    HEADER_SIZE = 64
+    _WRITE, _READ, _CAPACITY, _DONE, _RETURNCODE, _PID, _CANCELLED = 0, 8, 16, 24, 28, 32, 36
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._buf = shm.buf
+        self.owner = owner
+        self.name = shm.name
+        self.closed = False
+        self.capacity = _U64.unpack_from(self._buf, self._CAPACITY)[0]
+
+    @classmethod
+    def create(cls, capacity):
+        shm = shared_memory.SharedMemory(create=True, size=cls.HEADER_SIZE + capacity)
+        shm.buf[:cls.HEADER_SIZE] = bytes(cls.HEADER_SIZE)
+        _U64.pack_into(shm.buf, cls._CAPACITY, capacity)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # The bot owns and unlinks the segment; without this the worker's resource
+        # tracker would unlink it (and warn) when the worker exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    def _get(self, field, fmt=_U64):
+        return fmt.unpack_from(self._buf, field)[0]
+
+    def _set(self, field, value, fmt=_U64):
+        fmt.pack_into(self._buf, field, value)
+
+    def _copy_in(self, position, data):
+        start = self.HEADER_SIZE + position % self.capacity
+        first = min(len(data), self.HEADER_SIZE + self.capacity - start)
+        self._buf[start:start + first] = data[:first]
+        if first < len(data):
+            self._buf[self.HEADER_SIZE:self.HEADER_SIZE + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        start = self.HEADER_SIZE + position % self.capacity
+        first = min(size, self.HEADER_SIZE + self.capacity - start)
+        data = bytes(self._buf[start:start + first])
+        if first < size:
+            data += bytes(self._buf[self.HEADER_SIZE:self.HEADER_SIZE + size - first])
+        return data
+
+    # Producer side
+
+    def write(self, packet):
+        """Copies a packet in, waiting for room; returns False if the consumer cancelled."""
+        record = _LENGTH.pack(len(packet)) + packet
+        if len(record) > self.capacity:
+            raise ValueError("packet larger than the ring")
+        position = self._get(self._WRITE)
+        while self.capacity - (position - self._get(self._READ)) < len(record):
+            if self.cancelled:
+                return False
+            time.sleep(0.005)
+        self._copy_in(position, record)
+        self._set(self._WRITE, position + len(record))
+        return not self.cancelled
+
+    def set_pid(self, pid):
+        self._set(self._PID, pid, _I32)
+
+    def finish(self, returncode):
+        self._set(self._RETURNCODE, returncode, _I32)
+        self._set(self._DONE, 1, _I32)
+
+    # Consumer side
+
+    def read(self):
+        """Returns the next packet, None if none is ready yet, or b"" once the producer is done."""
+        done = self.done
+        position = self._get(self._READ)
+        if self._get(self._WRITE) == position:
+            return b"" if done else None
+        size = _LENGTH.unpack(self._copy_out(position, _LENGTH.size))[0]
+        data = self._copy_out(position + _LENGTH.size, size)
+        self._set(self._READ, position + _LENGTH.size + size)
+        return data
+
+    def cancel(self):
+        self._set(self._CANCELLED, 1, _I32)
+
+    @property
+    def done(self):
+        return self._get(self._DONE, _I32) == 1
+
+    @property
+    def cancelled(self):
+        return self._get(self._CANCELLED, _I32) == 1
+
+    @property
+    def returncode(self):
+        return self._get(self._RETURNCODE, _I32) if self.done else None
+
+    @property
+    def pid(self):
+        return self._get(self._PID, _I32)
+
+    def close(self):
+        self.closed = True
+        self._buf = None
+        self._shm.close()
+        if self.owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+_processes = set()  # FFmpeg processes this worker is running
+
+def _run_stream(job):
+    """Runs one FFmpeg job into its ring (worker side, one thread per stream)."""
+    ring = PacketRing.attach(job["ring"])
+    returncode = -1
+    try:
+        process = subprocess.Popen(["ffmpeg", *job["args"]], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    except OSError as e:
+        logging.error(f"Error starting FFmpeg: {e}")
+        ring.finish(returncode)
+        ring.close()
+        return
+    ring.set_pid(process.pid)
+    _processes.add(process)
+    try:
+        for packet in OggStream(process.stdout).iter_packets():
+            if packet.startswith(OPUS_HEADERS):
+                continue
+            if not ring.write(packet):
+                break
+    except Exception as e:
+        logging.error(f"Error reading FFmpeg output: {e}")
+    finally:
+        if ring.cancelled and process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        try:
+            returncode = process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            returncode = process.wait()
+        _processes.discard(process)
+        ring.finish(returncode)
+        ring.close()
+
+def _serve():
+    """Worker entry point: runs every job read from stdin until it closes, then kills what is left."""
+    for line in sys.stdin:
+        threading.Thread(target=_run_stream, args=(json.loads(line),), daemon=True).start()
+    for process in list(_processes):
+        process.kill()
+
+class RemoteProcess:
+    """Stands in for the Popen of an FFmpeg run by a worker, for TranscoderSlot accounting."""
+
+    def __init__(self, ring):
+        self._ring = ring
+
+    # The ring may be unmapped by WorkerStream.cleanup() on another thread at any point
+
+    @property
+    def pid(self):
+        try:
+            return self._ring.pid
+        except TypeError:
+            return 0
+
+    def poll(self):
+        try:
+            return self._ring.returncode
+        except TypeError:
+            return 0  # Closed: the stream is over
+
+    def kill(self):
+        try:
+            self._ring.cancel()
+        except TypeError:
+            pass
+
+class WorkerStream:
+    """Reads the packets of one worker-run FFmpeg job from its ring (bot side).
+
+    Has the read()/cleanup()/on_complete interface of OpusEncoder. read()
+    waits for the next packet the way a pipe read would, polling the ring.
+    """
+
+    # Longest wait for a packet before the stream is treated as stalled
+    READ_TIMEOUT = 30
+
+    def __init__(self, pool, worker, ring, slot=None):
+        self._pool = pool
+        self._worker = worker
+        self._ring = ring
+        self._lock = threading.Lock()  # Keeps cleanup() from unmapping the ring mid-read
+        self._closed = False
+        self._exhausted = False
+        self.slot = slot
+        if slot is not None:
+            slot.attach(RemoteProcess(ring))
+        self.on_complete = None
+
+    def is_opus(self):
+        return True
+
+    def read(self):
+        deadline = time.monotonic() + self.READ_TIMEOUT
+        while True:
+            with self._lock:
+                if self._closed:
+                    return b""
+                data = self._ring.read()
+            if data is not None:
+                if not data:
+                    self._exhausted = True
+                return data
+            if time.monotonic() > deadline or self._worker.poll() is not None:
+                logging.error("Audio worker stream stalled")
+                return b""
+            time.sleep(0.002)
+
+    def cleanup(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # The producer is done once read() has returned b"", so the return code is final
+            completed = self._exhausted and self._ring.returncode == 0
+            self._ring.cancel()
+            if self.slot is not None:
+                self.slot.release()
+            self._ring.close()
+        self._pool._stream_closed(self._worker)
+        if self.on_complete is not None:
+            on_complete, self.on_complete = self.on_complete, None
+            on_complete(completed)
+
+class AudioWorkerPool:
+    """Pool of worker processes that run FFmpeg jobs and stream packets back over shared memory.
+
+    Workers are started on first use, each new stream goes to the worker with
+    the fewest open streams, and a worker that died is replaced.
+    """
+
+    def __init__(self, processes, ring_bytes=1024 * 1024):
+        self.processes = processes
+        self.ring_bytes = ring_bytes
+        self._workers = []
+        self._streams = {}  # worker -> open stream count
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        worker = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE, text=True)
+        self._streams[worker] = 0
+        return worker
+
+    def _pick_locked(self):
+        for index, worker in enumerate(self._workers):
+            if worker.poll() is not None:
+                logging.error(f"Audio worker {worker.pid} exited with {worker.returncode}; starting a new one")
+                self._streams.pop(worker, None)
+                self._workers[index] = self._spawn()
+        while len(self._workers) < self.processes:
+            self._workers.append(self._spawn())
+        return min(self._workers, key=self._streams.__getitem__)
+
+    def open(self, args, slot=None):
+        """Starts `ffmpeg *args` (which must write Ogg Opus to stdout) in a worker; returns its WorkerStream."""
+        ring = PacketRing.create(self.ring_bytes)
+        try:
+            with self._lock:
+                worker = self._pick_locked()
+                worker.stdin.write(json.dumps({"ring": ring.name, "args": args}) + "\n")
+                worker.stdin.flush()
+                self._streams[worker] += 1
+        except Exception:
+            ring.close()
+            raise
+        return WorkerStream(self, worker, ring, slot)
+
+    def _stream_closed(self, worker):
+        with self._lock:
+            if worker in self._streams:
+                self._streams[worker] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"workers": len(self._workers), "streams": sum(self._streams.values())}
+
+    def close(self):
+        """Stops every worker; closing a worker's stdin makes it kill its FFmpeg processes and exit."""
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._streams.clear()
+        for worker in workers:
+            try:
+                worker.stdin.close()
+                worker.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                worker.kill()
+
+# Shared by every player; AUDIO_WORKERS=0 (the default) keeps FFmpeg output handling in the bot process
+_workers = int(os.getenv("AUDIO_WORKERS", "0"))
+audio_workers = AudioWorkerPool(_workers, int(os.getenv("AUDIO_WORKER_RING_BYTES", str(1024 * 1024)))) if _workers > 0 else None
+if audio_workers is not None:
+    atexit.register(audio_workers.close)
+
+if __name__ == "__main__":
+    _serve()
@@ -0,0 +1,469 @@
+"""Local stand-ins for Discord, FFmpeg and the database, used by the load benchmark.
+
+FakeGateway turns synthetic gateway payloads into real discord.py objects
+through the bot's own ConnectionState, so commands run exactly as they would
+live. FakeHTTP answers the REST calls commands make, FakeVoiceClient feeds
+discord.py's AudioPlayer thread (which reads one 20 ms frame at a time at
+real-time pace), the fake ffmpeg script writes Ogg Opus pages of silence, and
+FakePostgresPool and FakeMongoClient keep the servers table in memory.
+"""
+import asyncio
+import itertools
+import os
+import re
+import stat
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import discord
+from discord.player import AudioPlayer
+
+# Written to a temporary directory put first on PATH; ignores its input and writes
+# `seconds` of Ogg Opus packets at the requested bitrate, one page per second
+FAKE_FFMPEG = """#!{python}
+import re, struct, sys
+args = " ".join(sys.argv[1:])
+bitrate = int(re.search(r"-b:a (\\d+)k", args).group(1)) if "-b:a" in args else 128
+out = sys.stdout.buffer
+def page(packets, sequence):
+    segments = b"".join(bytes([255] * (len(p) // 255) + [len(p) % 255]) for p in packets)
+    out.write(b"OggS" + struct.pack("<xBQIIIB", 0, 0, 1, sequence, 0, len(segments)) + segments + b"".join(packets))
+page([b"OpusHead" + bytes(11)], 0)
+page([b"OpusTags" + bytes(8)], 1)
+packet = bytes(bitrate * 1000 // 8 // 50)
+try:
+    for second in range({seconds}):
+        page([packet] * 50, second + 2)
+    out.flush()
+except BrokenPipeError:
+    pass
+"""
+
+def install_fake_ffmpeg(directory, seconds):
+    """Writes the fake ffmpeg to directory and puts it first on PATH."""
+    path = os.path.join(directory, "ffmpeg")
+    with open(path, "w") as f:
+        f.write(FAKE_FFMPEG.format(python=sys.executable, seconds=seconds))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+    return path
+
+_snowflakes = itertools.count(100_000_000_000_000_000)
+_TIMESTAMP = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+
+def snowflake():
+    return next(_snowflakes)
+
+def user_payload(user_id, name, bot=False):
+    return {"id": str(user_id), "username": name, "discriminator": "0001", "avatar": "0" * 32, "bot": bot}
+
+def member_payload(user_id, name, role_ids=()):
+    return {
+        "user": user_payload(user_id, name),
+        "roles": [str(role_id) for role_id in role_ids],
+        "joined_at": _TIMESTAMP,
+        "deaf": False,
+        "mute": False,
+    }
+
+class FakeGuild:
+    """IDs of one simulated server: a text and a voice channel, two roles and its members."""
+
+    def __init__(self, members):
+        self.id = snowflake()
+        self.text_channel_id = snowflake()
+        self.voice_channel_id = snowflake()
+        self.role_ids = [snowflake(), snowflake()]
+        self.member_ids = [snowflake() for _ in range(members)]
+        self.owner_id = self.member_ids[0]
+        self.in_voice = False
+
+    def member(self, user_id):
+        return member_payload(user_id, f"user{user_id % 100000}", self.role_ids[:1])
+
+    def payload(self):
+        voice_states = []
+        if self.in_voice:
+            voice_states.append({
+                "user_id": str(self.owner_id), "channel_id": str(self.voice_channel_id), "session_id": "0",
+                "deaf": False, "mute": False, "self_deaf": False, "self_mute": False,
+                "self_video": False, "suppress": False,
+            })
+        everyone = {"id": str(self.id), "name": "@everyone", "permissions": "0", "position": 0}
+        roles = [everyone] + [
+            {"id": str(role_id), "name": f"role{index}", "permissions": "0", "position": index + 1}
+            for index, role_id in enumerate(self.role_ids)
+        ]
+        return {
+            "id": str(self.id),
+            "name": f"server{self.id % 100000}",
+            "owner_id": str(self.owner_id),
+            "roles": roles,
+            "emojis": [],
+            "stickers": [],
+            "features": [],
+            "member_count": len(self.member_ids),
+            "channels": [
+                {"id": str(self.text_channel_id), "type": 0, "name": "general", "position": 0, "permission_overwrites": []},
+                {"id": str(self.voice_channel_id), "type": 2, "name": "Music", "position": 1, "permission_overwrites": [],
+                 "bitrate": 64000, "user_limit": 0},
+            ],
+            "members": [self.member(user_id) for user_id in self.member_ids],
+            "voice_states": voice_states,
+        }
+
+class FakeGateway:
+    """Stands in for the bot's gateway connection (bot.ws).
+
+    Creates servers and delivers messages through the bot's ConnectionState,
+    and answers member queries (the converters' fallback) with member chunks
+    after `latency` seconds.
+    """
+
+    def __init__(self, bot, latency=0.05):
+        self.bot = bot
+        self.state = bot._connection
+        self.latency = latency
+        self.guilds = {}  # server id -> FakeGuild
+        self.state.user = discord.ClientUser(state=self.state, data=user_payload(snowflake(), "bench", bot=True))
+
+    def is_ratelimited(self):
+        return False
+
+    def create_guild(self, guild):
+        self.guilds[guild.id] = guild
+        self.state._add_guild_from_data(guild.payload())
+
+    async def request_chunks(self, guild_id, query=None, *, limit, user_ids=None, presences=False, nonce=None):
+        guild = self.guilds[guild_id]
+        if user_ids is not None:
+            found = [user_id for user_id in user_ids if user_id in guild.member_ids]
+        else:
+            found = [user_id for user_id in guild.member_ids if f"user{user_id % 100000}".startswith(query)][:limit]
+        data = {
+            "guild_id": str(guild_id), "members": [guild.member(user_id) for user_id in found],
+            "chunk_index": 0, "chunk_count": 1, "nonce": nonce,
+        }
+        asyncio.get_running_loop().call_later(self.latency, self.state.parse_guild_members_chunk, data)
+
+    def message(self, guild, content, author_id=None):
+        """Delivers a MESSAGE_CREATE for content, sent by author_id (the server owner by default)."""
+        author_id = author_id or guild.owner_id
+        member = guild.member(author_id)
+        data = {
+            "id": str(snowflake()), "channel_id": str(guild.text_channel_id), "guild_id": str(guild.id),
+            "author": member.pop("user"), "member": member, "content": content, "timestamp": _TIMESTAMP,
+            "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [],
+            "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0,
+        }
+        self.state.parse_message_create(data)
+        return int(data["id"])
+
+class FakeHTTP:
+    """Answers the REST calls the cogs make, each after `latency` seconds."""
+
+    def __init__(self, gateway, latency=0.03):
+        self.gateway = gateway
+        self.latency = latency
+        self.requests = 0
+
+    async def _request(self):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    def _message(self, channel_id, message_id, params):
+        payload = params.payload or {}
+        return {
+            "id": str(message_id), "channel_id": str(channel_id), "author": user_payload(self.gateway.state.user.id, "bench", bot=True),
+            "content": payload.get("content") or "", "timestamp": _TIMESTAMP, "edited_timestamp": None,
+            "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+            "embeds": payload.get("embeds") or [], "pinned": False, "type": 0,
+        }
+
+    async def send_message(self, channel_id, *, params):
+        await self._request()
+        return self._message(channel_id, snowflake(), params)
+
+    async def edit_message(self, channel_id, message_id, *, params):
+        await self._request()
+        return self._message(channel_id, message_id, params)
+
+    async def get_member(self, guild_id, member_id):
+        await self._request()
+        guild = self.gateway.guilds[guild_id]
+        if member_id not in guild.member_ids:
+            raise discord.NotFound(_Response(404), "Unknown Member")
+        return guild.member(member_id)
+
+    async def ban(self, user_id, guild_id, delete_message_days=1, reason=None):
+        await self._request()
+
+    async def unban(self, user_id, guild_id, *, reason=None):
+        await self._request()
+
+    async def kick(self, user_id, guild_id, reason=None):
+        await self._request()
+
+    async def add_role(self, guild_id, user_id, role_id, *, reason=None):
+        await self._request()
+
+    async def remove_role(self, guild_id, user_id, role_id, *, reason=None):
+        await self._request()
+
+    async def close(self):
+        pass
+
+class _Response:
+    def __init__(self, status):
+        self.status = status
+        self.reason = ""
+
+class _VoiceSocket:
+    async def speak(self, state):
+        pass
+
+class FakeVoiceClient(discord.VoiceProtocol):
+    """Voice connection that plays through discord.py's AudioPlayer and counts the packets it is handed."""
+
+    # A packet this late after the previous one is counted as a late frame (the player missed its 20 ms slot)
+    LATE_AFTER = 0.04
+
+    connect_latency = 0.1
+    clients = []  # Every client created, for the benchmark's totals
+
+    def __init__(self, client, channel):
+        super().__init__(client, channel)
+        self.guild = channel.guild
+        self.ws = _VoiceSocket()
+        self._connected = threading.Event()
+        self._player = None
+        self.packets = 0
+        self.late_packets = 0
+        self._last_packet = None
+        FakeVoiceClient.clients.append(self)
+
+    async def connect(self, *, timeout, reconnect, self_deaf=False, self_mute=False):
+        await asyncio.sleep(self.connect_latency)
+        self._connected.set()
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected.clear()
+        self.cleanup()
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    def is_connected(self):
+        return self._connected.is_set()
+
+    def send_audio_packet(self, data, *, encode=True):
+        now = time.perf_counter()
+        if self._last_packet is not None and now - self._last_packet > self.LATE_AFTER:
+            self.late_packets += 1
+        self._last_packet = now
+        self.packets += 1
+
+    def play(self, source, *, after=None):
+        if not self.is_connected():
+            raise discord.ClientException("Not connected to voice.")
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        self._last_packet = None
+        self._player = AudioPlayer(source, self, after=after)
+        self._player.start()
+
+    def is_playing(self):
+        return self._player is not None and self._player.is_playing()
+
+    def is_paused(self):
+        return self._player is not None and self._player.is_paused()
+
+    def stop(self):
+        if self._player is not None:
+            self._player.stop()
+            self._player = None
+
+    def pause(self):
+        if self._player is not None:
+            self._player.pause()
+
+    def resume(self):
+        if self._player is not None:
+            self._last_packet = None
+            self._player.resume()
+
+    @property
+    def source(self):
+        return self._player.source if self._player is not None else None
+
+class ServerTable:
+    """The servers table both database stand-ins read and write, one dict per row."""
+
+    def __init__(self, latency=0.002):
+        self.latency = latency
+        self.rows = {}  # server id -> {column: value}
+        self.queries = 0
+
+    async def wait(self):
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+
+    def upsert(self, server_id, fields):
+        self.rows.setdefault(server_id, {"server_id": server_id}).update(fields)
+
+class _Record(dict):
+    """Row that can be indexed by column name or position, like an asyncpg Record."""
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+_INSERT = re.compile(r"INSERT INTO servers \(([^)]*)\)")
+_SELECT = re.compile(r"SELECT (.*?) FROM servers(?: WHERE server_id = \$1)?$")
+
+class _Transaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class _Cursor:
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class FakePostgresConnection:
+    """Understands the handful of statements Database runs against the servers table."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def transaction(self, **kwargs):
+        return _Transaction()
+
+    def _upsert(self, query, args):
+        columns = [column.strip() for column in _INSERT.search(query).group(1).split(",")]
+        self.table.upsert(args[0], dict(zip(columns[1:], args[1:])))
+
+    def _select(self, query, server_id=None):
+        columns = [column.strip() for column in _SELECT.search(query).group(1).split(",")]
+        rows = [self.table.rows[server_id]] if server_id is not None and server_id in self.table.rows else []
+        if server_id is None:
+            rows = self.table.rows.values()
+        return [_Record((column, row.get(column)) for column in columns) for row in rows]
+
+    async def execute(self, query, *args, timeout=None):
+        await self.table.wait()
+        if query.lstrip().startswith("INSERT INTO servers"):
+            self._upsert(query, args)
+        return "OK"
+
+    async def executemany(self, query, rows, timeout=None):
+        await self.table.wait()
+        for args in rows:
+            self._upsert(query, args)
+
+    async def fetchrow(self, query, *args, timeout=None):
+        await self.table.wait()
+        rows = self._select(query, args[0])
+        return rows[0] if rows else None
+
+    async def fetch(self, query, *args, timeout=None):
+        await self.table.wait()
+        if "LEFT(prefix, 1)" in query:
+            initials = {row["prefix"][0] for row in self.table.rows.values() if row.get("prefix")}
+            return [_Record(initial=initial) for initial in initials]
+        return self._select(query)
+
+    def cursor(self, query, prefetch=None):
+        return _Cursor(self._select(query))
+
+class _Acquire:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        return self.connection
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakePostgresPool:
+    """Stands in for an asyncpg pool; every connection shares one in-memory servers table."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def acquire(self, timeout=None):
+        return _Acquire(FakePostgresConnection(self.table))
+
+    async def close(self):
+        pass
+
+class _MongoCursor:
+    def __init__(self, table, documents):
+        self.table = table
+        self._documents = documents
+
+    def __aiter__(self):
+        return _Cursor(self._documents).__aiter__()
+
+    async def to_list(self, length=None):
+        await self.table.wait()
+        return list(self._documents)
+
+class FakeMongoCollection:
+    """Stands in for the motor servers collection."""
+
+    def __init__(self, table):
+        self.table = table
+
+    async def find_one(self, query):
+        await self.table.wait()
+        row = self.table.rows.get(query["server_id"])
+        return dict(row) if row is not None else None
+
+    async def update_one(self, query, update, upsert=False):
+        await self.table.wait()
+        self.table.upsert(query["server_id"], update["$set"])
+
+    async def bulk_write(self, operations, ordered=True):
+        await self.table.wait()
+        for operation in operations:
+            self.table.upsert(operation._filter["server_id"], operation._doc["$set"])
+
+    def find(self, query=None, projection=None, batch_size=None):
+        return _MongoCursor(self.table, [dict(row) for row in self.table.rows.values()])
+
+    def aggregate(self, pipeline):
+        initials = {row["prefix"][0] for row in self.table.rows.values() if row.get("prefix")}
+        return _MongoCursor(self.table, [{"_id": initial} for initial in initials])
+
+class FakeMongoClient:
+    """Stands in for a motor client whose database holds the servers collection."""
+
+    def __init__(self, table):
+        self.table = table
+        self._database = {"servers": FakeMongoCollection(table)}
+
+    def __getitem__(self, name):
+        return self
+
+    def __getattr__(self, name):
+        return self._database[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,298 @@
+"""Replays synthetic command traffic through the music, admin and utility cogs across thousands of servers.
+
+Nothing talks to Discord, FFmpeg or a database: the bot built by main.py gets
+a fake gateway and REST client, voice connections are fake clients fed by
+discord.py's real-time AudioPlayer thread, a stand-in ffmpeg writes Ogg Opus
+silence, and the servers table lives in memory behind a PostgreSQL or MongoDB
+stand-in (see benchmarks/fakes.py).
+
+The run has two phases. First every voice server starts a song, and the bot's
+CPU time is measured against the audio it streams. Then commands arrive at a
+fixed rate from random servers while that audio keeps playing. The report
+covers commands/sec, p50/p99 command latency, event-loop lag, CPU per stream
+and RSS per server.
+
+Run from the project root:
+
+    python -m benchmarks.load_bench --guilds 2000 --voice-guilds 50 --rate 300 --duration 30
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+_directory = tempfile.mkdtemp()
+os.environ["PLAYER_STATE_STORE"] = "file"
+os.environ["PLAYER_STATE_FILE"] = os.path.join(_directory, "player_state.jsonl")
+os.environ.setdefault("AUDIO_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("TRACK_RESOLVER", "local")
+os.environ.setdefault("TRACK_RESOLVER_CACHE", "")
+os.environ.setdefault("FFMPEG_MAX_PROCESSES", "1000")  # Measure the pipeline, not the process cap
+
+import discord
+
+import main
+from audio import transcoder
+from benchmarks.fakes import (
+    FakeGateway, FakeGuild, FakeHTTP, FakeMongoClient, FakePostgresPool, FakeVoiceClient, ServerTable,
+    install_fake_ffmpeg,
+)
+from core import member_cache, outbound
+from data import database
+
+FRAME_SECONDS = 0.02
+
+# (weight, voice servers only, command); {member} and {role} are IDs from the server
+COMMANDS = [
+    (16, True, "!play https://example.com/{guild}/{song}.mp3"),
+    (3, True, "!skip"),
+    (2, True, "!pause"),
+    (2, True, "!resume"),
+    (1, True, "!volume {volume}"),
+    (8, False, "!queue"),
+    (2, False, "!shuffle"),
+    (2, False, "!dedupe"),
+    (12, False, "!ping"),
+    (8, False, "!get_user {member}"),
+    (3, False, "!get_role {role}"),
+    (3, False, "!get_channel {channel}"),
+    (5, False, "!get_prefix"),
+    (2, False, "!set_prefix !"),
+    (2, False, "!set_channel {channel} music"),
+    (2, False, "!add_role {member} {role}"),
+    (1, False, "!remove_role {member} {role}"),
+    (1, False, "!kick {member}"),
+]
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, where /proc is missing
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Recorder:
+    """Times each command from its MESSAGE_CREATE to on_command_completion or on_command_error."""
+
+    def __init__(self, bot):
+        self.started = {}  # message id -> (command name, perf_counter at dispatch)
+        self.latencies = defaultdict(list)  # command name -> seconds
+        self.errors = Counter()
+        self.done = asyncio.Event()
+        bot.add_listener(self.on_command_completion)
+        bot.add_listener(self.on_command_error)
+
+    def sent(self, message_id, name):
+        self.started[message_id] = (name, time.perf_counter())
+        self.done.clear()
+
+    def _finish(self, ctx):
+        entry = self.started.pop(ctx.message.id, None)
+        if entry is not None:
+            self.latencies[entry[0]].append(time.perf_counter() - entry[1])
+        if not self.started:
+            self.done.set()
+
+    async def on_command_completion(self, ctx):
+        self._finish(ctx)
+
+    async def on_command_error(self, ctx, error):
+        original = getattr(error, "original", error)
+        self.errors[f"{ctx.command or ctx.invoked_with}: {type(original).__name__}"] += 1
+        self._finish(ctx)
+
+    def all_latencies(self):
+        return [latency for latencies in self.latencies.values() for latency in latencies]
+
+class LoopLag:
+    """Samples how late the event loop wakes up from a short sleep."""
+
+    INTERVAL = 0.05
+
+    def __init__(self):
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.INTERVAL)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.INTERVAL))
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+        return self.samples
+
+def audio_totals():
+    packets = sum(client.packets for client in FakeVoiceClient.clients)
+    late = sum(client.late_packets for client in FakeVoiceClient.clients)
+    return packets, late
+
+def print_lag(name, samples):
+    print(
+        f"  event-loop lag ({name}): p50 {percentile(samples, 0.5) * 1000:.1f} ms, "
+        f"p99 {percentile(samples, 0.99) * 1000:.1f} ms, max {max(samples, default=0) * 1000:.1f} ms"
+    )
+
+def setup_database(kind, table, db):
+    db.database_type = kind
+    if kind == "postgresql":
+        db.connection = FakePostgresPool(table)
+    else:
+        db.connection = FakeMongoClient(table)
+        db.db = db.connection["discord_music_bot"]
+
+async def run(args):
+    rng = random.Random(args.seed)
+    install_fake_ffmpeg(_directory, args.track_seconds)
+    FakeVoiceClient.connect_latency = args.voice_ms / 1000
+    discord.VoiceChannel.connect = functools.partialmethod(discord.abc.Connectable.connect, cls=FakeVoiceClient)
+
+    bot = main.bot
+    await bot._async_setup_hook()
+    gateway = FakeGateway(bot, latency=args.gateway_ms / 1000)
+    bot.ws = gateway
+    bot.http = bot._connection.http = FakeHTTP(gateway, latency=args.rest_ms / 1000)
+
+    table = ServerTable(latency=args.db_ms / 1000)
+    guilds = [FakeGuild(args.members) for _ in range(args.guilds)]
+    for guild in rng.sample(guilds, len(guilds) // 10):
+        table.upsert(guild.id, {"prefix": "!"})  # One server in ten has a stored prefix row
+    voice_guilds = guilds[:args.voice_guilds]
+    for guild in voice_guilds:
+        guild.in_voice = True
+
+    setup_database(args.database, table, database)
+    await bot.setup_hook()  # Loads every cog and warms the prefix initials and settings cache from the stand-in
+
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    for guild in guilds:
+        gateway.create_guild(guild)
+    create_seconds = time.perf_counter() - started
+    rss_guilds = rss_bytes()
+
+    bot._ready.set()
+    recorder = Recorder(bot)
+    lag = LoopLag()
+    songs = Counter()
+
+    def send(guild, template):
+        songs[guild.id] += 1
+        content = template.format(
+            guild=guild.id,
+            song=songs[guild.id],
+            volume=rng.randint(10, 100),
+            member=rng.choice(guild.member_ids[1:]),
+            role=rng.choice(guild.role_ids),
+            channel=guild.text_channel_id,
+        )
+        recorder.sent(gateway.message(guild, content), content.split()[0][1:])
+
+    print(f"{args.guilds} servers ({args.voice_guilds} in voice), {args.members} members each, "
+          f"member cache policy {member_cache.policy}, {args.database} stand-in")
+    print(f"  created servers in {create_seconds:.2f} s, gateway cache {(rss_guilds - rss_before) / args.guilds / 1024:.1f} KiB per server")
+
+    # Phase 1: every voice server starts a song and queues a few more
+    lag.start()
+    for guild in voice_guilds:
+        for _ in range(args.queue + 1):
+            send(guild, COMMANDS[0][2])
+    await asyncio.wait_for(recorder.done.wait(), 60)
+    await asyncio.sleep(1)  # Let the players reach steady state
+    cpu, packets = time.process_time(), audio_totals()[0]
+    await asyncio.sleep(args.stream_seconds)
+    cpu, packets = time.process_time() - cpu, audio_totals()[0] - packets
+    stream_lag = lag.stop()
+    streamed = packets * FRAME_SECONDS
+    streams = sum(1 for client in FakeVoiceClient.clients if client.is_playing())
+    print(f"Streaming: {streams} streams for {args.stream_seconds:.0f} s")
+    if streamed:
+        print(f"  bot CPU per stream: {cpu / streamed * 100:.2f}% of a core ({cpu:.2f} CPU s for {streamed:.0f} s of audio)")
+    print_lag("streaming", stream_lag)
+
+    # Phase 2: commands at a fixed rate from random servers, with the audio still playing
+    recorder.latencies.clear()
+    recorder.errors.clear()
+    any_server = [entry for entry in COMMANDS if not entry[1]]
+    lag.start()
+    sent = 0
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < args.duration:
+        due = int(elapsed * args.rate)
+        while sent < due:
+            guild = rng.choice(guilds)
+            pool = COMMANDS if guild.in_voice else any_server
+            _, _, template = rng.choices(pool, weights=[entry[0] for entry in pool])[0]
+            send(guild, template)
+            sent += 1
+        await asyncio.sleep(0.001)
+    try:
+        await asyncio.wait_for(recorder.done.wait(), 30)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+    command_lag = lag.stop()
+    latencies = recorder.all_latencies()
+    packets, late = audio_totals()
+    rss_end = rss_bytes()
+
+    print(f"Commands: {sent} sent at {args.rate}/s for {args.duration:.0f} s")
+    print(f"  {len(latencies) / elapsed:.0f} commands/s completed, {len(recorder.started)} unanswered")
+    print(f"  latency p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    for name, values in sorted(recorder.latencies.items(), key=lambda item: -percentile(item[1], 0.99))[:5]:
+        print(f"    {name}: {len(values)} runs, p50 {percentile(values, 0.5) * 1000:.1f} ms, p99 {percentile(values, 0.99) * 1000:.1f} ms")
+    for error, count in recorder.errors.most_common(5):
+        print(f"    error {error}: {count}")
+    print_lag("commands", command_lag)
+    print(f"  late audio frames: {late / packets:.2%} of {packets}" if packets else "  no audio frames played")
+    stats = outbound.stats()
+    print(f"  {bot.http.requests} REST calls, {table.queries} database queries, "
+          f"{stats['sent']} messages sent ({stats['merged']} notices merged)")
+    member_stats = member_cache.stats()
+    print(f"  member LRU: {member_stats['entries']} members, hit ratio {member_stats['hit_ratio']:.1%}")
+    print(f"  RSS {rss_end / 1024 ** 2:.0f} MiB, {(rss_end - rss_before) / args.guilds / 1024:.1f} KiB per server")
+
+    for client in FakeVoiceClient.clients:
+        client.stop()
+    for guild in voice_guilds:
+        transcoder.kill_guild(guild.id)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--guilds", type=int, default=2000, help="simulated servers")
+    parser.add_argument("--voice-guilds", type=int, default=50, help="servers whose owner is in a voice channel")
+    parser.add_argument("--members", type=int, default=50, help="members per server")
+    parser.add_argument("--rate", type=float, default=300, help="commands per second in the command phase")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of command traffic")
+    parser.add_argument("--stream-seconds", type=float, default=10, help="seconds of audio-only measurement")
+    parser.add_argument("--queue", type=int, default=3, help="songs queued per voice server before the command phase")
+    parser.add_argument("--track-seconds", type=int, default=60, help="length of every fake song")
+    parser.add_argument("--database", choices=("postgresql", "mongodb"), default="postgresql")
+    parser.add_argument("--db-ms", type=float, default=2, help="database stand-in latency per query")
+    parser.add_argument("--rest-ms", type=float, default=30, help="fake REST API latency per call")
+    parser.add_argument("--gateway-ms", type=float, default=50, help="fake gateway latency for member queries")
+    parser.add_argument("--voice-ms", type=float, default=100, help="fake voice connection time")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(arguments))
@@ -0,0 +1,85 @@
+"""Compares TrackQueue with the plain list MusicPlayer used to keep its queue in.
+
+Run from the project root:
+
+    python -m benchmarks.queue_bench
+"""
+import random
+import time
+
+from audio.queue import Track, TrackQueue
+
+SIZES = (10_000, 50_000, 100_000)
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - started) * 1000
+
+def list_enqueue(queue, tracks):
+    for track in tracks:
+        queue.append(track)
+
+def list_drain(queue):
+    while queue:
+        queue.pop(0)
+
+def list_remove_random(queue, indexes):
+    for index in indexes:
+        queue.pop(index)
+
+def list_shuffle(queue):
+    random.shuffle(queue)
+
+def list_dedupe(queue):
+    seen = set()
+    queue[:] = [track for track in queue if not (track.url in seen or seen.add(track.url))]
+
+def trackqueue_enqueue(queue, tracks):
+    queue.extend(tracks)
+
+def trackqueue_drain(queue):
+    while queue:
+        queue.popleft()
+
+def trackqueue_remove_random(queue, indexes):
+    for index in indexes:
+        queue.pop(index)
+
+def trackqueue_shuffle(queue):
+    queue.shuffle()
+
+def trackqueue_dedupe(queue):
+    queue.dedupe()
+
+def run(size):
+    # Roughly one in ten entries is a repeat, as in real playlist imports
+    tracks = [Track(f"https://example.com/track/{random.randrange(size * 9 // 10)}") for _ in range(size)]
+    removals = [random.randrange(size // 2) for _ in range(1000)]
+    results = {}
+    for name, factory, enqueue, drain, remove, shuffle, dedupe in (
+        ("list", list, list_enqueue, list_drain, list_remove_random, list_shuffle, list_dedupe),
+        ("TrackQueue", TrackQueue, trackqueue_enqueue, trackqueue_drain, trackqueue_remove_random,
+         trackqueue_shuffle, trackqueue_dedupe),
+    ):
+        queue = factory()
+        timings = {"enqueue": timed(enqueue, queue, tracks)}
+        timings["shuffle"] = timed(shuffle, queue)
+        timings["remove x1000"] = timed(remove, queue, removals)
+        timings["dedupe"] = timed(dedupe, queue)
+        timings["drain"] = timed(drain, queue)
+        results[name] = timings
+    return results
+
+def main():
+    for size in SIZES:
+        results = run(size)
+        print(f"{size} tracks")
+        for operation in results["list"]:
+            baseline = results["list"][operation]
+            candidate = results["TrackQueue"][operation]
+            speedup = baseline / candidate if candidate else float("inf")
+            print(f"  {operation:<14} list {baseline:9.2f} ms   TrackQueue {candidate:9.2f} ms   x{speedup:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Times MusicCog.restore_players for 10,000 saved servers against PLAYER_RESTORE_TARGET_MS.
+
+Snapshots are written to a temporary append-only file store and read back
+through the cog, with Discord objects replaced by minimal stand-ins. Voice
+reconnection is skipped: it is network-bound and runs after the timed part.
+
+Run from the project root:
+
+    python -m benchmarks.restore_bench
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+_directory = tempfile.mkdtemp()
+os.environ["PLAYER_STATE_STORE"] = "file"
+os.environ["PLAYER_STATE_FILE"] = os.path.join(_directory, "player_state.jsonl")
+os.environ.setdefault("AUDIO_CACHE_MAX_BYTES", "0")
+os.environ.setdefault("TRACK_RESOLVER_CACHE", "")
+
+from audio.queue import Track, TrackQueue
+from cogs.music import PLAYER_RESTORE_TARGET_MS, MusicCog, MusicPlayer
+from data import player_states
+
+GUILDS = 10_000
+QUEUE_LENGTH = 50
+
+class Channel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+class VoiceClient:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return True
+
+    def is_paused(self):
+        return False
+
+class Guild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.voice_client = None
+        self._channels = {guild_id * 10 + 1: Channel(guild_id * 10 + 1), guild_id * 10 + 2: Channel(guild_id * 10 + 2)}
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+class Bot:
+    def __init__(self, guilds):
+        self.guilds = {guild.id: guild for guild in guilds}
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+class Source:
+    position = 95.0
+
+def saved_player(bot, guild):
+    player = MusicPlayer(bot, guild, guild.get_channel(guild.id * 10 + 1))
+    player.queue = TrackQueue(
+        Track(f"https://example.com/{guild.id}/{i}.mp3", f"Song {i}", 210.0, 100000000000000000 + i)
+        for i in range(QUEUE_LENGTH)
+    )
+    player.current_song = Track(f"https://example.com/{guild.id}/current.mp3", "Current", 240.0)
+    player.current_source = Source()
+    # One server in ten had left voice, so it comes back parked
+    if guild.id % 10:
+        player.voice_client = VoiceClient(guild.get_channel(guild.id * 10 + 2))
+    return player.pack()
+
+async def main():
+    guilds = [Guild(guild_id) for guild_id in range(1, GUILDS + 1)]
+    bot = Bot(guilds)
+    states = {guild.id: saved_player(bot, guild) for guild in guilds}
+    await player_states.save(states)
+    size = os.path.getsize(os.environ["PLAYER_STATE_FILE"])
+
+    async def reconnect(self, voice_channel):
+        pass
+
+    MusicPlayer.reconnect = reconnect
+    cog = MusicCog(bot)
+    started = time.perf_counter()
+    await cog.restore_players()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"{GUILDS} servers, {QUEUE_LENGTH + 1} songs each, {size / 1024 ** 2:.1f} MiB of snapshots")
+    print(f"  restored {len(cog.music_players)} players and {len(cog.parked)} parked queues in {elapsed_ms:.0f} ms")
+    print(f"  target {PLAYER_RESTORE_TARGET_MS:.0f} ms: {'met' if elapsed_ms <= PLAYER_RESTORE_TARGET_MS else 'MISSED'}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import signal
+import logging
+import subprocess
+from dotenv import load_dotenv
+
+import requests
+
+# Load environment variables from .env
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+IDENTIFY_INTERVAL = 5  # Seconds Discord requires between identifies in one concurrency bucket
+RESTART_DELAY_MAX = 60  # Longest wait before restarting a worker that keeps crashing
+STABLE_AFTER = 300  # Seconds a worker must stay up for its restart delay to reset
+
+def recommended_shards(token):
+    """Returns (shard_count, max_concurrency) recommended by Discord for this bot."""
+    response = requests.get(GATEWAY_URL, headers={"Authorization": f"Bot {token}"}, timeout=10)
+    response.raise_for_status()
+    data = response.json()
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+class Worker:
+    """One bot process running a fixed slice of the shards."""
+
+    def __init__(self, cluster_id, shard_ids, shard_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.started_at = None
+        self.restart_delay = 1
+        self.restart_at = None  # Set while waiting to restart after a crash
+
+    def start(self):
+        env = dict(os.environ)
+        env["SHARD_COUNT"] = str(self.shard_count)
+        env["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in self.shard_ids)
+        env["CLUSTER_ID"] = str(self.cluster_id)
+        # The append-only player state file is per process; the guilds in it belong to this worker's shards
+        root, extension = os.path.splitext(os.getenv("PLAYER_STATE_FILE", "player_state.jsonl"))
+        env["PLAYER_STATE_FILE"] = f"{root}.{self.cluster_id}{extension}"
+        if os.getenv("METRICS_PORT"):
+            # One metrics endpoint per process, on consecutive ports
+            env["METRICS_PORT"] = str(int(os.getenv("METRICS_PORT")) + self.cluster_id)
+        self.process = subprocess.Popen([sys.executable, "main.py"], env=env)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        logging.info(f"Started cluster {self.cluster_id} (pid {self.process.pid}) with shards {self.shard_ids}")
+
+    def check(self):
+        """Restarts the worker if it crashed; returns False once it has exited cleanly."""
+        if self.restart_at is not None:
+            if time.monotonic() >= self.restart_at:
+                self.start()
+            return True
+        returncode = self.process.poll()
+        if returncode is None:
+            return True
+        if returncode == 0:
+            logging.info(f"Cluster {self.cluster_id} shut down")
+            return False
+        if time.monotonic() - self.started_at >= STABLE_AFTER:
+            self.restart_delay = 1
+        logging.error(f"Cluster {self.cluster_id} exited with {returncode}; restarting in {self.restart_delay}s")
+        self.restart_at = time.monotonic() + self.restart_delay
+        self.restart_delay = min(self.restart_delay * 2, RESTART_DELAY_MAX)
+        return True
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+def main():
+    token = os.getenv("DISCORD_TOKEN")
+    if not token:
+        logging.error("DISCORD_TOKEN is not set in .env file")
+        exit(1)
+
+    max_concurrency = 1
+    if os.getenv("SHARD_COUNT"):
+        shard_count = int(os.getenv("SHARD_COUNT"))
+    else:
+        shard_count, max_concurrency = recommended_shards(token)
+    processes = os.cpu_count() or 1
+    shards_per_process = int(os.getenv("SHARDS_PER_PROCESS", str(-(-shard_count // processes))))
+    shard_ids = list(range(shard_count))
+    workers = [
+        Worker(cluster_id, shard_ids[start:start + shards_per_process], shard_count)
+        for cluster_id, start in enumerate(range(0, shard_count, shards_per_process))
+    ]
+    logging.info(f"Running {shard_count} shards in {len(workers)} processes")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Each worker identifies its shards one after another; staggering the starts
+    # keeps the workers from identifying at once and hitting Discord's limit
+    stagger = shards_per_process * IDENTIFY_INTERVAL / max_concurrency
+    for worker in workers:
+        if stopping:
+            break
+        worker.start()
+        if worker is not workers[-1]:
+            time.sleep(stagger)
+
+    running = list(workers)
+    while running and not stopping:
+        running = [worker for worker in running if worker.check()]
+        time.sleep(1)
+
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.process is not None:
+            worker.process.wait()
+
+if __name__ == "__main__":
+    main()
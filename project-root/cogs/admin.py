@@ -1,38 +1,44 @@
 import discord
 from discord.ext import commands
-import logging
+import asyncio
+import io
+import os
+import threading
+import time
 
-from database import Database
+from core import URGENT, CachedMemberConverter, member_cache, outbound, sample_stacks
+from data import database
 
-logging.basicConfig(level=logging.INFO)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
 
 class AdminCog(commands.Cog, name="Administration"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.database = Database()
+        self.database = database  # The handle every cog shares; it connects on first use
 
     @commands.command(name="set_prefix", help="Sets the command prefix for the server.")
     @commands.has_permissions(administrator=True)
     async def set_prefix(self, ctx: commands.Context, prefix: str):
         """Sets the command prefix for the server."""
-        self.database.set_server_prefix(ctx.guild.id, prefix)
-        await ctx.send(f"Command prefix set to `{prefix}`.")
+        await self.database.set_server_prefix(ctx.guild.id, prefix)
+        outbound.post(ctx.channel, f"Command prefix set to `{prefix}`.")
 
     @commands.command(name="get_prefix", help="Retrieves the current command prefix for the server.")
     async def get_prefix(self, ctx: commands.Context):
         """Retrieves the current command prefix for the server."""
-        prefix = self.database.get_server_prefix(ctx.guild.id)
-        await ctx.send(f"Current command prefix is `{prefix}`.")
+        prefix = await self.database.get_server_prefix(ctx.guild.id)
+        outbound.post(ctx.channel, f"Current command prefix is `{prefix}`.")
 
     @commands.command(name="ban", help="Bans a user from the server.")
     @commands.has_permissions(ban_members=True)
-    async def ban(self, ctx: commands.Context, member: discord.Member, reason: str = None):
+    async def ban(self, ctx: commands.Context, member: CachedMemberConverter, reason: str = None):
         """Bans a user from the server."""
         try:
             await member.ban(reason=reason)
-            await ctx.send(f"Banned {member.name}#{member.discriminator}.")
+            member_cache.forget(ctx.guild.id, member.id)
+            outbound.post(ctx.channel, f"Banned {member.name}#{member.discriminator}.")
         except discord.Forbidden:
-            await ctx.send(f"I don't have permission to ban {member.name}#{member.discriminator}.")
+            outbound.post(ctx.channel, f"I don't have permission to ban {member.name}#{member.discriminator}.", priority=URGENT)
 
     @commands.command(name="unban", help="Unbans a user from the server.")
     @commands.has_permissions(ban_members=True)
@@ -40,50 +46,53 @@ class AdminCog(commands.Cog, name="Administration"):
         """Unbans a user from the server."""
         try:
             await ctx.guild.unban(user, reason=reason)
-            await ctx.send(f"Unbanned {user.name}#{user.discriminator}.")
+            outbound.post(ctx.channel, f"Unbanned {user.name}#{user.discriminator}.")
         except discord.Forbidden:
-            await ctx.send(f"I don't have permission to unban {user.name}#{user.discriminator}.")
+            outbound.post(ctx.channel, f"I don't have permission to unban {user.name}#{user.discriminator}.", priority=URGENT)
 
     @commands.command(name="kick", help="Kicks a user from the server.")
     @commands.has_permissions(kick_members=True)
-    async def kick(self, ctx: commands.Context, member: discord.Member, reason: str = None):
+    async def kick(self, ctx: commands.Context, member: CachedMemberConverter, reason: str = None):
         """Kicks a user from the server."""
         try:
             await member.kick(reason=reason)
-            await ctx.send(f"Kicked {member.name}#{member.discriminator}.")
+            member_cache.forget(ctx.guild.id, member.id)
+            outbound.post(ctx.channel, f"Kicked {member.name}#{member.discriminator}.")
         except discord.Forbidden:
-            await ctx.send(f"I don't have permission to kick {member.name}#{member.discriminator}.")
+            outbound.post(ctx.channel, f"I don't have permission to kick {member.name}#{member.discriminator}.", priority=URGENT)
 
     @commands.command(name="add_role", help="Assigns a role to a user.")
     @commands.has_permissions(manage_roles=True)
-    async def add_role(self, ctx: commands.Context, member: discord.Member, role: discord.Role):
+    async def add_role(self, ctx: commands.Context, member: CachedMemberConverter, role: discord.Role):
         """Assigns a role to a user."""
         try:
             await member.add_roles(role)
-            await ctx.send(f"Added role {role.name} to {member.name}#{member.discriminator}.")
+            member_cache.forget(ctx.guild.id, member.id)
+            outbound.post(ctx.channel, f"Added role {role.name} to {member.name}#{member.discriminator}.")
         except discord.Forbidden:
-            await ctx.send(f"I don't have permission to add roles to {member.name}#{member.discriminator}.")
+            outbound.post(ctx.channel, f"I don't have permission to add roles to {member.name}#{member.discriminator}.", priority=URGENT)
 
     @commands.command(name="remove_role", help="Removes a role from a user.")
     @commands.has_permissions(manage_roles=True)
-    async def remove_role(self, ctx: commands.Context, member: discord.Member, role: discord.Role):
+    async def remove_role(self, ctx: commands.Context, member: CachedMemberConverter, role: discord.Role):
         """Removes a role from a user."""
         try:
             await member.remove_roles(role)
-            await ctx.send(f"Removed role {role.name} from {member.name}#{member.discriminator}.")
+            member_cache.forget(ctx.guild.id, member.id)
+            outbound.post(ctx.channel, f"Removed role {role.name} from {member.name}#{member.discriminator}.")
         except discord.Forbidden:
-            await ctx.send(f"I don't have permission to remove roles from {member.name}#{member.discriminator}.")
+            outbound.post(ctx.channel, f"I don't have permission to remove roles from {member.name}#{member.discriminator}.", priority=URGENT)
 
     @commands.command(name="set_channel", help="Sets a specific channel for bot actions.")
     @commands.has_permissions(administrator=True)
     async def set_channel(self, ctx: commands.Context, channel: discord.TextChannel, action: str):
         """Sets a specific channel for bot actions."""
         if action.lower() not in ["music", "log"]:
-            await ctx.send(f"Invalid action. Please use 'music' or 'log'.")
+            outbound.post(ctx.channel, f"Invalid action. Please use 'music' or 'log'.", priority=URGENT)
             return
 
-        self.database.set_server_channel(ctx.guild.id, action, channel.id)
-        await ctx.send(f"Set {action} channel to {channel.mention}.")
+        await self.database.set_server_channel(ctx.guild.id, action, channel.id)
+        outbound.post(ctx.channel, f"Set {action} channel to {channel.mention}.")
 
     @commands.command(name="reload_cogs", help="Reloads all the bot's cogs.")
     @commands.has_permissions(administrator=True)
@@ -92,17 +101,32 @@ class AdminCog(commands.Cog, name="Administration"):
         for filename in os.listdir('./cogs'):
             if filename.endswith('.py'):
                 try:
-                    self.bot.reload_extension(f'cogs.{filename[:-3]}')
-                    await ctx.send(f"Reloaded cog: {filename[:-3]}.")
+                    await self.bot.reload_extension(f'cogs.{filename[:-3]}')
+                    outbound.post(ctx.channel, f"Reloaded cog: {filename[:-3]}.")
                 except Exception as e:
-                    await ctx.send(f"Failed to reload cog {filename[:-3]}: {e}")
+                    outbound.post(ctx.channel, f"Failed to reload cog {filename[:-3]}: {e}", priority=URGENT)
 
     @commands.command(name="shutdown", help="Shuts down the bot gracefully.")
     @commands.is_owner()  # Ensure only the bot owner can use this command
     async def shutdown(self, ctx: commands.Context):
         """Shuts down the bot gracefully."""
-        await ctx.send("Shutting down...")
-        await self.bot.close()
+        outbound.post(ctx.channel, "Shutting down...")
+        await outbound.drain()  # Sends the messages still queued before the connection closes
+        await self.bot.close()  # Saves the music queues and flushes buffered settings writes (see main.py)
 
-def setup(bot: commands.Bot):
-    bot.add_cog(AdminCog(bot))
\ No newline at end of file
+    @commands.command(name="profile", help="Profiles the event loop and music players for a number of seconds (default 10).")
+    @commands.is_owner()
+    async def profile(self, ctx: commands.Context, seconds: float = 10.0):
+        """Samples the event loop and player threads and uploads the stacks in collapsed format."""
+        seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+        outbound.post(ctx.channel, f"Profiling for {seconds:g} seconds...")
+        # The sampler runs in a worker thread so the loop keeps running while it is watched
+        stacks = await asyncio.to_thread(sample_stacks, seconds, threading.get_ident())
+        filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        outbound.post(
+            ctx.channel, "Profile done; open it with speedscope or flamegraph.pl.",
+            priority=URGENT, file=discord.File(io.BytesIO(stacks.encode()), filename=filename),
+        )
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(AdminCog(bot))
\ No newline at end of file
@@ -0,0 +1,103 @@
+from discord.ext import commands
+import os
+import time
+
+from audio import audio_cache, audio_workers, resolver, transcoder
+from core import member_cache, outbound, registry
+from data import database
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 keeps the endpoint off
+
+COMMAND_SECONDS = registry.histogram(
+    "bot_command_duration_seconds", "Time to run a command, including its checks and argument conversion.", ("command",)
+)
+COMMAND_ERRORS = registry.counter("bot_command_errors_total", "Commands that ended in an error.", ("command",))
+
+class MetricsCog(commands.Cog, name="Metrics"):
+    """Times every command and serves the metrics registry on METRICS_HOST:METRICS_PORT.
+
+    Everything that is already counted elsewhere (caches, FFmpeg processes,
+    players and their queues, outbound messages) is read when the endpoint is
+    scraped, so it costs nothing between scrapes.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._series = {}  # Command name -> (duration, errors) series, bound on first use
+
+    async def cog_load(self):
+        registry.add_collector(self.collect)
+        if METRICS_PORT:
+            await registry.start(METRICS_HOST, METRICS_PORT)
+
+    async def cog_unload(self):
+        registry.remove_collector(self.collect)
+        await registry.stop()
+
+    # Bot.invoke dispatches on_command before the checks and converters run, then
+    # on_command_completion or on_command_error; the start time travels on ctx
+    @commands.Cog.listener()
+    async def on_command(self, ctx):
+        ctx.metrics_started = time.perf_counter()
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        self._observe(ctx, failed=False)
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        self._observe(ctx, failed=True)
+
+    def _observe(self, ctx, failed):
+        started = getattr(ctx, "metrics_started", None)
+        if ctx.command is None or started is None:
+            return  # Unknown command, or one that started before this cog was loaded
+        name = ctx.command.qualified_name
+        series = self._series.get(name)
+        if series is None:
+            series = self._series[name] = (COMMAND_SECONDS.labels(name), COMMAND_ERRORS.labels(name))
+        series[0].observe(time.perf_counter() - started)
+        if failed:
+            series[1].inc()
+
+    def collect(self):
+        """Scrape-time metrics read from the counters and state the rest of the bot keeps."""
+        music = self.bot.get_cog("Music")
+        if music is not None:
+            players = list(music.music_players.items())
+            yield "music_players", "gauge", "Music players in memory.", [({}, len(players))]
+            yield "music_parked_players", "gauge", "Idle players whose queue is parked.", [({}, len(music.parked))]
+            yield "music_active_streams", "gauge", "Songs playing, per server.", [
+                ({"guild": guild_id}, 1) for guild_id, player in players
+                if player.voice_client is not None and player.voice_client.is_playing()
+            ]
+            yield "music_queue_depth", "gauge", "Songs queued, per server with a non-empty queue.", [
+                ({"guild": guild_id}, len(player.queue)) for guild_id, player in players if len(player.queue)
+            ]
+
+        stats = transcoder.stats()
+        yield "ffmpeg_processes", "gauge", "FFmpeg processes running.", [({}, stats["active"])]
+        yield "ffmpeg_waiting", "gauge", "Songs waiting for a free FFmpeg slot.", [({}, stats["waiting"])]
+        yield "ffmpeg_max_processes", "gauge", "FFmpeg process limit.", [({}, stats["max_processes"])]
+        if audio_workers is not None:
+            stats = audio_workers.stats()
+            yield "audio_worker_streams", "gauge", "Streams carried by audio worker processes.", [({}, stats["streams"])]
+
+        caches = {"settings": database.cache, "tracks": resolver, "members": member_cache}
+        if audio_cache is not None:
+            caches["audio"] = audio_cache
+        yield "cache_hits_total", "counter", "Cache lookups that hit.", [
+            ({"cache": name}, cache.hits) for name, cache in caches.items()
+        ]
+        yield "cache_misses_total", "counter", "Cache lookups that missed.", [
+            ({"cache": name}, cache.misses) for name, cache in caches.items()
+        ]
+
+        stats = outbound.stats()
+        yield "outbound_messages_sent_total", "counter", "Messages sent to Discord.", [({}, stats["sent"])]
+        yield "outbound_notices_merged_total", "counter", "Notices merged into another message.", [({}, stats["merged"])]
+        yield "outbound_queued_messages", "gauge", "Messages waiting to be sent.", [({}, stats["queued"])]
+
+async def setup(bot):
+    await bot.add_cog(MetricsCog(bot))
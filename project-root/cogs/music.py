@@ -1,177 +1,729 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import asyncio
+import json
 import logging
-import subprocess
 import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
 from dotenv import load_dotenv
 
+from audio import (
+    QUALITY_BITRATES, QueuePages, Track, TrackQueue, TrackSource, audio_cache, audio_workers, import_playlist, is_playlist,
+    resolver, transcoder,
+)
+from core import URGENT, ThrottledErrors, outbound, registry
+from data import player_states
+
 load_dotenv()  # Load environment variables from .env
 
-logging.basicConfig(level=logging.INFO)
+PLAYLIST_MAX_TRACKS = int(os.getenv("PLAYLIST_MAX_TRACKS", "1000"))
+PLAYLIST_PROGRESS_INTERVAL = float(os.getenv("PLAYLIST_PROGRESS_INTERVAL", "3"))
+PLAYER_IDLE_TIMEOUT = float(os.getenv("PLAYER_IDLE_TIMEOUT", "300"))
+PARKED_PLAYERS_MAX = int(os.getenv("PARKED_PLAYERS_MAX", "10000"))
+PLAYER_SNAPSHOT_INTERVAL = float(os.getenv("PLAYER_SNAPSHOT_INTERVAL", "5"))
+PLAYER_SNAPSHOT_POSITION_STEP = 30  # Seconds of playback between snapshots of an otherwise unchanged player
+PLAYER_RESTORE_TARGET_MS = float(os.getenv("PLAYER_RESTORE_TARGET_MS", "2000"))
+PLAYER_RESTORE_CONCURRENCY = 25  # Voice connections opened at once while resuming players
+PREFETCH_LEAD_SECONDS = float(os.getenv("PREFETCH_LEAD_SECONDS", "15"))  # Next song starts decoding this long before the end
+FFMPEG_SLOT_TIMEOUT = float(os.getenv("FFMPEG_SLOT_TIMEOUT", "30"))  # Longest wait for a free FFmpeg process to start a song
+PLAYER_START_ATTEMPTS = 3  # Times the head of the queue may fail to start before it is dropped
+
+GAP_SECONDS = registry.histogram(
+    "music_gap_seconds", "Silence between the end of a song and the first packet of the next one.",
+    buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+# A broken source or FFmpeg fails the same way for every server; those errors are rate limited
+playback_errors = ThrottledErrors(logging.getLogger(__name__))
 
 class MusicPlayer:
-    def __init__(self, ctx):
-        self.ctx = ctx
+    def __init__(self, bot, guild, channel):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel  # Text channel the player posts to
         self.voice_client = None
-        self.queue = []
+        self.queue = TrackQueue()
+        self.queue_pages = QueuePages(self.queue)
         self.current_song = None
         self.volume = 0.5
         self.playback_quality = "high" 
-
-    async def play_music(self, song_url=None):
+        self.current_source = None
+        self.next_song = None  # Head of the queue, already decoding so it can follow without a gap
+        self.next_source = None
+        self._prefetch_timer = None  # Starts decoding the next song PREFETCH_LEAD_SECONDS before the end
+        # The player thread hands off to the next song itself (see _play_next_now), so every
+        # change to the queue or the look-ahead on the event loop is made under this lock too
+        self._lock = threading.RLock()
+        self.last_gap_ms = None  # Silence between the last two songs, in milliseconds
+        self._previous_ended_at = None
+        self._stopped = False  # Set by stop/leave so the finishing song does not start the next one
+        self._import_task = None  # Playlist still being added in the background
+        self.last_active = time.monotonic()
+        self._resume = None  # (track, seconds) to seek to when a restored track starts
+        self._failed_song = None  # Head of the queue that last failed to start, and how many times in a row
+        self._start_failures = 0
+        self.saved_key = None  # snapshot_key() as of the last saved snapshot
+
+    async def play_music(self, song_url=None, requester_id=None):
+        started = time.perf_counter()
+        previous_song = self.current_song
         if song_url is None:
-            if len(self.queue) > 0:
-                self.current_song = self.queue.pop(0)
+            with self._lock:
+                song = self.queue.popleft() if len(self.queue) > 0 else None
+            if song is not None:
+                self.current_song = song
             else:
-                await self.ctx.send("Queue is empty! Add some music.")
+                outbound.post(self.channel, "Queue is empty! Add some music.")
                 return
         else:
-            self.current_song = song_url
+            self.current_song = Track(song_url, requester_id=requester_id)
+            await resolver.apply([self.current_song])
 
         if self.voice_client is None:
-            await self.join_voice_channel()
+            outbound.post(self.channel, "Not connected to any voice channel.")
+            return
 
+        source = None
         try:
-            # Use FFmpeg to convert the audio stream to a playable format
-            ffmpeg_process = subprocess.Popen(
-                [
-                    "ffmpeg",
-                    "-i",
-                    self.current_song,
-                    "-vn",  # Remove video
-                    "-acodec",
-                    "libopus",
-                    "-ar",
-                    "48000",
-                    "-f",
-                    "opus",
-                    "-",
-                ],
-                stdout=subprocess.PIPE,
-            )
-
-            # Play the audio using Pygame
-            self.voice_client.play(
-                discord.PCMVolumeTransformer(
-                    discord.FFmpegPCMAudio(
-                        ffmpeg_process.stdout,
-                        bitrate=128000,
-                        executable="ffmpeg",
-                    ),
-                    volume=self.volume,
-                ),
-                after=lambda error: self.check_play_next(error),
+            source = self._take_next(self.current_song)
+            if source is None:
+                # Waits for a free FFmpeg slot when the process-wide budget is used up
+                try:
+                    slot = await transcoder.acquire(self.guild.id, timeout=FFMPEG_SLOT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise RuntimeError(f"no FFmpeg process became free within {FFMPEG_SLOT_TIMEOUT:.0f}s") from None
+                source = self._create_source(self.current_song, slot)
+            self._start_source(source)
+        except Exception as e:
+            if source is not None:
+                source.cleanup()  # Stops its FFmpeg process and frees the transcoder slot
+            failed = self.current_song
+            self.current_song = previous_song
+            playback_errors.error(
+                "play_music", f"Error playing music: {e}", guild_id=self.guild.id, duration=time.perf_counter() - started
             )
-            await self.ctx.send(f"Now playing: {self.current_song}")
+            if song_url is None:
+                self._start_failures = self._start_failures + 1 if self._failed_song is failed else 1
+                self._failed_song = failed
+                if self._start_failures < PLAYER_START_ATTEMPTS:
+                    with self._lock:
+                        self.queue.appendleft(failed)  # Back at the head, as _play_next_now does
+                else:
+                    # Requeued once more, it would block the rest of the queue for good
+                    self._failed_song, self._start_failures = None, 0
+                    outbound.post(self.channel, f"Error playing music: {e}. Removed {failed} from the queue.", priority=URGENT)
+                    return
+            outbound.post(self.channel, f"Error playing music: {e}", priority=URGENT)
+            return
+        self._failed_song, self._start_failures = None, 0
+        outbound.post(self.channel, f"Now playing: {self.current_song}")
+        await self._prepare_next()
+
+    def _create_source(self, song, slot):
+        # A single FFmpeg process encodes straight to Opus at the quality's bitrate (or the
+        # encoding is read from the audio cache) and discord.py sends the packets as they are
+        start = 0.0
+        if self._resume is not None and self._resume[0] is song:
+            start = self._resume[1]  # Restored mid-song: pick up where it was
+        return TrackSource(
+            song.url,
+            bitrate=QUALITY_BITRATES[self.playback_quality],
+            volume=self.volume,
+            start=start,
+            cache=audio_cache,
+            slot=slot,
+            workers=audio_workers,
+            duration=song.duration,
+        )
+
+    def _start_source(self, source):
+        previous = self.current_source, self._resume, self._stopped
+        self._stopped = False
+        self._resume = None
+        source.on_start = self._record_gap
+        self.current_source = source
+        try:
+            self.voice_client.play(source, after=lambda error: self.check_play_next(error))
+        except Exception:
+            # e.g. "Already playing audio": the song that is playing keeps its source
+            self.current_source, self._resume, self._stopped = previous
+            raise
+
+    def _record_gap(self, started_at):
+        # Runs on the player thread when the first packet of a song is read
+        if self._previous_ended_at is not None:
+            self.last_gap_ms = (started_at - self._previous_ended_at) * 1000
+            self._previous_ended_at = None
+            GAP_SECONDS.observe(self.last_gap_ms / 1000)
+            logging.info(f"Gap before {self.current_song}: {self.last_gap_ms:.1f} ms")
+
+    async def _prepare_next(self):
+        """Starts decoding the head of the queue PREFETCH_LEAD_SECONDS before the current song ends.
+
+        Songs of unknown length are prepared at once. Either way the slot is
+        given back if another server has to wait for one (see _reclaim_next).
+        """
+        with self._lock:
+            if len(self.queue) == 0:
+                self._discard_next()
+                return
+            if self.next_song is self.queue[0]:
+                return
+            self._discard_next()
+            delay = self._prefetch_delay()
+            if delay > 0:
+                self._prefetch_timer = asyncio.get_running_loop().call_later(delay, self._prefetch_due)
+                return
+            song = self.queue[0]
+        slot = transcoder.try_acquire(self.guild.id)
+        if slot is None:
+            return  # No spare FFmpeg slot; the next song starts after a short gap instead
+        try:
+            source = self._create_source(song, slot)
         except Exception as e:
-            logging.error(f"Error playing music: {e}")
-            await self.ctx.send(f"Error playing music: {e}")
+            logging.error(f"Error preparing next song: {e}")
+            return
+        with self._lock:
+            # The song may have started (or left the queue) while FFmpeg was starting
+            stale = len(self.queue) == 0 or self.queue[0] is not song or self.next_source is not None
+            if not stale:
+                self.next_song, self.next_source = song, source
+        if stale:
+            source.cleanup()
+            return
+        slot.reclaim = lambda: self._reclaim_next(source)
+        await asyncio.get_running_loop().run_in_executor(None, source.prime)
+
+    def _prefetch_delay(self):
+        """Seconds until the next song should start decoding; 0 if now (or if the length is unknown)."""
+        song, source = self.current_song, self.current_source
+        if song is None or song.duration is None or source is None or not self._is_active():
+            return 0.0
+        return song.duration - source.position - PREFETCH_LEAD_SECONDS
+
+    def _prefetch_due(self):
+        self._prefetch_timer = None
+        # Checked again, since a pause stops the clock and the queue may have changed
+        asyncio.create_task(self._prepare_next())
+
+    def _reclaim_next(self, source):
+        # Another server waits for an FFmpeg slot; the next song here can start after a short gap
+        with self._lock:
+            if self.next_source is not source:
+                return False  # Already playing, or discarded
+            self._discard_next()
+        return True
+
+    def _take_next(self, song):
+        """Returns the prepared source if it belongs to song, discarding it otherwise."""
+        with self._lock:
+            source = self.next_source if self.next_song is song else None
+            if source is not None:
+                self.next_song = self.next_source = None
+            else:
+                self._discard_next()
+        return source
+
+    def _discard_next(self):
+        with self._lock:
+            if self._prefetch_timer is not None:
+                self._prefetch_timer.cancel()
+                self._prefetch_timer = None
+            if self.next_source is not None:
+                self.next_source.cleanup()
+            self.next_song = self.next_source = None
+
+    def _play_next_now(self):
+        """Hands off to the prepared next song from the player thread; False if there is none."""
+        with self._lock:
+            song, source = self.next_song, self.next_source
+            if source is None or len(self.queue) == 0 or self.queue[0] is not song:
+                return False
+            self.next_song = self.next_source = None
+            self.current_song = self.queue.popleft()
+            try:
+                self._start_source(source)
+            except Exception as e:
+                logging.error(f"Error starting next song: {e}")
+                source.cleanup()
+                self.queue.appendleft(song)
+                return False
+        return True
+
+    async def _announce_next(self):
+        outbound.post(self.channel, f"Now playing: {self.current_song}")
+        await self._prepare_next()
+
+    def _halt(self):
+        """Stops playback without starting the next song and kills every FFmpeg process of this guild."""
+        self._stopped = True
+        self._cancel_import()
+        self._discard_next()
+        if self.voice_client is not None:
+            self.voice_client.stop()
+        transcoder.kill_guild(self.guild.id)
 
     async def stop_music(self):
         if self.voice_client is not None and self.voice_client.is_playing():
-            self.voice_client.stop()
-            await self.ctx.send("Stopped playing.")
+            self._halt()
+            outbound.post(self.channel, "Stopped playing.")
         else:
-            await self.ctx.send("Nothing is playing.")
+            outbound.post(self.channel, "Nothing is playing.")
 
     async def pause_music(self):
         if self.voice_client is not None and self.voice_client.is_playing():
             self.voice_client.pause()
-            await self.ctx.send("Paused playing.")
+            outbound.post(self.channel, "Paused playing.")
         else:
-            await self.ctx.send("Nothing is playing.")
+            outbound.post(self.channel, "Nothing is playing.")
 
     async def resume_music(self):
         if self.voice_client is not None and self.voice_client.is_paused():
             self.voice_client.resume()
-            await self.ctx.send("Resumed playing.")
+            outbound.post(self.channel, "Resumed playing.")
         else:
-            await self.ctx.send("The player is not paused.")
+            outbound.post(self.channel, "The player is not paused.")
 
     async def skip_music(self):
         if self.voice_client is not None and self.voice_client.is_playing():
             self.voice_client.stop()
-            await self.ctx.send("Skipped to next song.")
+            outbound.post(self.channel, "Skipped to next song.")
         else:
-            await self.ctx.send("Nothing is playing.")
+            outbound.post(self.channel, "Nothing is playing.")
+
+    def _is_active(self):
+        return self.voice_client is not None and (self.voice_client.is_playing() or self.voice_client.is_paused())
+
+    async def add_to_queue(self, song_url, requester_id=None):
+        track = Track(song_url, requester_id=requester_id)
+        await resolver.apply([track])  # Resolved once per URL across all servers, then served from cache
+        with self._lock:
+            self.queue.append(track)
+        outbound.post(self.channel, f"Added {track} to queue.")
+        if self._is_active():
+            await self._prepare_next()
+
+    def start_playlist_import(self, source, requester_id=None):
+        """Adds a playlist in the background; the first track plays as soon as it resolves."""
+        self._cancel_import()
+        self._import_task = asyncio.create_task(self._import_playlist(source, requester_id))
+
+    def _cancel_import(self):
+        if self._import_task is not None and not self._import_task.done():
+            self._import_task.cancel()
+        self._import_task = None
+
+    async def _import_playlist(self, source, requester_id):
+        # One progress message, edited at most every PLAYLIST_PROGRESS_INTERVAL seconds
+        progress = await outbound.post(self.channel, "Loading playlist...", coalesce=False)
+        added = 0
+        last_update = time.monotonic()
+        failed_head = None  # Song play_music could not start; not retried while it is still at the head
+        try:
+            batches = import_playlist(source, resolver, requester_id=requester_id, max_entries=PLAYLIST_MAX_TRACKS)
+            async for tracks in batches:
+                with self._lock:
+                    self.queue.extend(tracks)
+                    head = self.queue[0] if len(self.queue) > 0 else None
+                added += len(tracks)
+                if not self._is_active():
+                    if head is not failed_head:
+                        await self.play_music()
+                        if not self._is_active():
+                            failed_head = head  # play_music put it back at the head and posted the error
+                elif self.next_song is None:
+                    await self._prepare_next()
+                if time.monotonic() - last_update >= PLAYLIST_PROGRESS_INTERVAL:
+                    last_update = time.monotonic()
+                    await self._edit_progress(progress, f"Loading playlist... {added} songs added.")
+            await self._edit_progress(progress, f"Added {added} songs from the playlist.")
+        except asyncio.CancelledError:
+            await self._edit_progress(progress, f"Playlist import stopped after {added} songs.")
+            raise
+        except Exception as e:
+            logging.error(f"Error importing playlist {source}: {e}")
+            await self._edit_progress(progress, f"Error loading playlist after {added} songs: {e}")
 
-    async def add_to_queue(self, song_url):
-        self.queue.append(song_url)
-        await self.ctx.send(f"Added {song_url} to queue.")
+    @staticmethod
+    async def _edit_progress(progress, content):
+        if progress is None:  # None if the progress message could not be sent
+            return
+        try:
+            await progress.edit(content=content)
+        except discord.HTTPException as e:
+            # The message is only a progress report (it may have been deleted); the import goes on
+            logging.warning(f"Error updating playlist progress: {e}")
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def is_idle(self, timeout):
+        """Returns True once nothing has played or been requested for timeout seconds."""
+        busy = self._import_task is not None and not self._import_task.done()
+        if busy or (self.voice_client is not None and self.voice_client.is_playing()):
+            self.touch()
+            return False
+        return time.monotonic() - self.last_active >= timeout
+
+    def snapshot(self, keep_voice=True):
+        """Returns the queue, the song playing and its position as a JSON-serializable dict."""
+        connected = keep_voice and self.voice_client is not None and self.voice_client.is_connected()
+        current = None
+        position = 0.0
+        if self.current_song is not None and self._is_active():
+            current = self.current_song.to_state()
+            if self.current_source is not None:
+                position = round(self.current_source.position, 2)
+        return {
+            "channel_id": self.channel.id,
+            "voice_channel_id": self.voice_client.channel.id if connected else None,
+            "current": current,
+            "position": position,
+            "queue": self._queue_states(),
+            "volume": self.volume,
+            "quality": self.playback_quality,
+        }
+
+    def _queue_states(self):
+        with self._lock:
+            return [track.to_state() for track in self.queue]
+
+    def snapshot_key(self):
+        """Changes whenever the player is worth snapshotting again."""
+        active = self._is_active()
+        connected = self.voice_client is not None and self.voice_client.is_connected()
+        position = self.current_source.position if active and self.current_source is not None else 0.0
+        return (
+            self.queue.version,
+            id(self.current_song) if active else None,
+            self.volume,
+            self.playback_quality,
+            self.voice_client.channel.id if connected else None,
+            int(position // PLAYER_SNAPSHOT_POSITION_STEP),
+        )
+
+    def pack(self, keep_voice=True):
+        """Returns snapshot() as compressed JSON, or None if there is nothing worth keeping."""
+        state = self.snapshot(keep_voice)
+        if state["current"] is None and not state["queue"]:
+            return None
+        return zlib.compress(json.dumps(state, separators=(",", ":")).encode())
+
+    @staticmethod
+    def load_state(data):
+        """Decodes what pack() returned."""
+        return json.loads(zlib.decompress(data))
+
+    def restore(self, state):
+        """Queues a snapshot's songs, the interrupted one first; returns how many were queued."""
+        tracks = [Track.from_state(track) for track in state["queue"]]
+        if state["current"] is not None:
+            current = Track.from_state(state["current"])
+            tracks.insert(0, current)
+            self._resume = (current, state["position"])
+        with self._lock:
+            self.queue.extend(tracks)
+        self.volume = state["volume"]
+        self.playback_quality = state["quality"]
+        return len(tracks)
+
+    async def reconnect(self, voice_channel):
+        """Rejoins voice after a restart or reload, reusing a live connection, and resumes the queue."""
+        voice_client = self.guild.voice_client
+        if voice_client is not None and voice_client.is_connected():
+            if voice_client.channel != voice_channel:
+                await voice_client.move_to(voice_channel)
+        else:
+            voice_client = await voice_channel.connect()
+        self.voice_client = voice_client
+        if len(self.queue) > 0 and not self._is_active():
+            await self.play_music()
+
+    def detach(self):
+        """Stops playback but leaves the voice connection up for the next cog instance to reuse."""
+        self._halt()
+
+    async def shutdown(self):
+        """Stops playback and disconnects without posting anything to the channel."""
+        self._halt()
+        if self.voice_client is not None and self.voice_client.is_connected():
+            await self.voice_client.disconnect()
+        self.voice_client = None
+
+    def approx_bytes(self):
+        """Approximate memory held by the player and its queue."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__) + self.queue.approx_bytes()
+        for track in (self.current_song, self.next_song):
+            if track is not None:
+                size += track.approx_bytes()
+        return size
 
     def get_queue(self):
         return self.queue
 
     async def remove_from_queue(self, index):
-        if 0 <= index < len(self.queue):
-            removed_song = self.queue.pop(index)
-            await self.ctx.send(f"Removed {removed_song} from queue.")
+        with self._lock:
+            removed_song = self.queue.pop(index) if 0 <= index < len(self.queue) else None
+            if removed_song is not None and removed_song is self.next_song:
+                self._discard_next()
+        if removed_song is not None:
+            outbound.post(self.channel, f"Removed {removed_song} from queue.")
+            if self._is_active():
+                await self._prepare_next()
+        else:
+            outbound.post(self.channel, "Invalid queue index.", priority=URGENT)
+
+    async def move_in_queue(self, source, destination):
+        with self._lock:
+            valid = 0 <= source < len(self.queue) and 0 <= destination < len(self.queue)
+            moved_song = self.queue.move(source, destination) if valid else None
+        if valid:
+            outbound.post(self.channel, f"Moved {moved_song} to position {destination}.")
+            if self._is_active():
+                await self._prepare_next()
         else:
-            await self.ctx.send("Invalid queue index.")
+            outbound.post(self.channel, "Invalid queue index.", priority=URGENT)
+
+    async def shuffle_queue(self):
+        with self._lock:
+            self.queue.shuffle()
+        outbound.post(self.channel, "Queue shuffled.")
+        if self._is_active():
+            await self._prepare_next()
+
+    async def dedupe_queue(self):
+        with self._lock:
+            removed = self.queue.dedupe()
+        outbound.post(self.channel, f"Removed {removed} duplicate songs from queue.")
+        if self._is_active():
+            await self._prepare_next()
 
     async def clear_queue(self):
-        self.queue.clear()
-        await self.ctx.send("Queue cleared.")
+        self._cancel_import()
+        with self._lock:
+            self.queue.clear()
+            self._discard_next()
+        outbound.post(self.channel, "Queue cleared.")
 
-    async def join_voice_channel(self):
+    async def join_voice_channel(self, member):
         if self.voice_client is not None and self.voice_client.is_connected():
             return
 
         try:
-            channel = self.ctx.author.voice.channel
+            channel = member.voice.channel
             self.voice_client = await channel.connect()
-            await self.ctx.send(f"Joined {channel.name}")
+            outbound.post(self.channel, f"Joined {channel.name}")
         except AttributeError:
-            await self.ctx.send("You must be connected to a voice channel.")
+            outbound.post(self.channel, "You must be connected to a voice channel.", priority=URGENT)
         except discord.errors.VoiceConnectionError as e:
             logging.error(f"Error joining voice channel: {e}")
-            await self.ctx.send(f"Error joining voice channel: {e}")
+            outbound.post(self.channel, f"Error joining voice channel: {e}", priority=URGENT)
 
     async def leave_voice_channel(self):
         if self.voice_client is not None and self.voice_client.is_connected():
+            self._halt()
             await self.voice_client.disconnect()
-            await self.ctx.send("Left the voice channel.")
+            outbound.post(self.channel, "Left the voice channel.")
         else:
-            await self.ctx.send("Not connected to any voice channel.")
+            outbound.post(self.channel, "Not connected to any voice channel.")
 
     async def adjust_volume(self, volume):
-        if self.voice_client is not None and self.voice_client.is_playing():
-            self.volume = volume / 100
-            self.voice_client.source.volume = self.volume
-            await self.ctx.send(f"Volume set to {volume}%")
-        else:
-            await self.ctx.send("Nothing is playing.")
+        if not 0 <= volume <= 100:
+            outbound.post(self.channel, "Volume must be between 0 and 100.", priority=URGENT)
+            return
+        self.volume = volume / 100
+        self._discard_next()  # Restarted below with the new volume
+        source = self.voice_client.source if self.voice_client is not None else None
+        if isinstance(source, TrackSource):
+            try:
+                await source.set_volume(self.volume)
+            except Exception as e:
+                logging.error(f"Error changing volume: {e}")
+                outbound.post(self.channel, f"Volume set to {volume}% (from the next song).")
+                return
+        # With nothing playing, the volume is kept for the next song
+        outbound.post(self.channel, f"Volume set to {volume}%.")
+        if source is not None:
+            await self._prepare_next()
 
     async def set_playback_quality(self, quality):
         if quality.lower() in ["high", "medium", "low"]:
             self.playback_quality = quality.lower()
-            await self.ctx.send(f"Playback quality set to {self.playback_quality}.")
+            self._discard_next()
+            outbound.post(self.channel, f"Playback quality set to {self.playback_quality} (from the next song).")
+            if self.voice_client is not None and self.voice_client.source is not None:
+                await self._prepare_next()
         else:
-            await self.ctx.send("Invalid playback quality. Choose from 'high', 'medium', or 'low'.")
+            outbound.post(self.channel, "Invalid playback quality. Choose from 'high', 'medium', or 'low'.", priority=URGENT)
 
     def check_play_next(self, error):
         if error:
             logging.error(f"Error playing music: {error}")
-            asyncio.run_coroutine_threadsafe(self.ctx.send(f"Error playing music: {error}"), self.ctx.bot.loop)
+            outbound.post_threadsafe(self.bot.loop, self.channel, f"Error playing music: {error}", priority=URGENT)
+        if self._stopped:
+            return
+        if self.current_source is not None:
+            self._previous_ended_at = self.current_source.ended_at
         if len(self.queue) > 0:
-            asyncio.run_coroutine_threadsafe(self.play_music(), self.ctx.bot.loop)
+            if self._play_next_now():
+                asyncio.run_coroutine_threadsafe(self._announce_next(), self.bot.loop)
+            else:
+                asyncio.run_coroutine_threadsafe(self.play_music(), self.bot.loop)
 
 class MusicCog(commands.Cog, name="Music"):
     def __init__(self, bot):
         self.bot = bot
         self.music_players = {}  # Store music players for each server
-
-    @commands.command(name="play", help="Plays a song from YouTube, Spotify, or SoundCloud.")
+        self.parked = OrderedDict()  # guild_id -> packed queue of an evicted player, oldest first
+        self._unsaved_states = {}  # guild_id -> packed state (None deletes) not yet saved
+        self._restore_task = None
+
+    async def cog_load(self):
+        self.reap_idle_players.start()
+        self.snapshot_players.start()
+        self._restore_task = asyncio.create_task(self.restore_players())
+
+    async def cog_unload(self):
+        self.reap_idle_players.cancel()
+        self.snapshot_players.cancel()
+        if self._restore_task is not None:
+            self._restore_task.cancel()
+        # Every live player, changed or not: the saved position may be up to a snapshot step behind
+        await self.save_player_states(force=True)
+        for player in self.music_players.values():
+            player.detach()
+
+    async def cog_before_invoke(self, ctx):
+        player = self.music_players.get(ctx.guild.id) if ctx.guild is not None else None
+        if player is not None:
+            player.touch()
+
+    async def get_player(self, ctx):
+        """Returns the server's player, creating it and restoring a parked queue if needed."""
+        player = self.music_players.get(ctx.guild.id)
+        if player is None:
+            player = self.music_players[ctx.guild.id] = MusicPlayer(ctx.bot, ctx.guild, ctx.channel)
+            data = self.parked.pop(ctx.guild.id, None)
+            if data is not None:
+                restored = player.restore(MusicPlayer.load_state(data))
+                outbound.post(ctx.channel, f"Restored {restored} songs queued before the player went idle.")
+        return player
+
+    def _park(self, guild_id, data):
+        self.parked[guild_id] = data
+        self.parked.move_to_end(guild_id)
+        while len(self.parked) > PARKED_PLAYERS_MAX:
+            dropped, _ = self.parked.popitem(last=False)
+            self._unsaved_states[dropped] = None
+
+    @tasks.loop(seconds=60)
+    async def reap_idle_players(self):
+        """Disconnects players idle for PLAYER_IDLE_TIMEOUT seconds and parks their queues."""
+        for guild_id, player in list(self.music_players.items()):
+            if player.is_idle(PLAYER_IDLE_TIMEOUT):
+                await self.evict_player(guild_id)
+
+    async def evict_player(self, guild_id):
+        player = self.music_players.pop(guild_id, None)
+        if player is None:
+            return
+        # Packed before disconnecting, so a paused song is kept; without its voice channel,
+        # so a restart parks it again instead of rejoining
+        data = player.pack(keep_voice=False)
+        try:
+            await player.shutdown()
+        except Exception as e:
+            logging.error(f"Error disconnecting idle player in {guild_id}: {e}")
+        self._unsaved_states[guild_id] = data
+        if data is not None:
+            self._park(guild_id, data)
+        logging.info(f"Evicted idle music player in {guild_id}")
+
+    @tasks.loop(seconds=PLAYER_SNAPSHOT_INTERVAL)
+    async def snapshot_players(self):
+        await self.save_player_states()
+
+    async def save_player_states(self, force=False):
+        """Saves every player that changed since its last snapshot (every player with force), in one batch."""
+        changes, self._unsaved_states = self._unsaved_states, {}
+        keys = {}
+        for guild_id, player in self.music_players.items():
+            key = player.snapshot_key()
+            if force or key != player.saved_key:
+                changes[guild_id] = player.pack()
+                keys[guild_id] = key
+        if not changes:
+            return
+        if await player_states.save(changes):
+            for guild_id, key in keys.items():
+                player = self.music_players.get(guild_id)
+                if player is not None:
+                    player.saved_key = key
+        else:
+            # Live players are re-packed next time; evicted ones only exist in this batch
+            for guild_id, data in changes.items():
+                self._unsaved_states.setdefault(guild_id, data)
+
+    async def restore_players(self):
+        """Rebuilds every saved player from one bulk read and resumes playback where it stopped."""
+        await self.bot.wait_until_ready()
+        started = time.perf_counter()
+        states = await player_states.load()
+        read_ms = (time.perf_counter() - started) * 1000
+        resuming = []
+        for guild_id, data in states.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or guild_id in self.music_players:
+                continue  # Served by another shard, left since, or already in use again
+            try:
+                state = MusicPlayer.load_state(data)
+            except (ValueError, zlib.error) as e:
+                logging.error(f"Error reading saved music player for {guild_id}: {e}")
+                continue
+            channel = guild.get_channel(state["channel_id"])
+            voice_channel = guild.get_channel(state["voice_channel_id"]) if state["voice_channel_id"] else None
+            if channel is None or voice_channel is None:
+                self._park(guild_id, data)
+                continue
+            player = self.music_players[guild_id] = MusicPlayer(self.bot, guild, channel)
+            player.restore(state)
+            player.saved_key = player.snapshot_key()
+            resuming.append((player, voice_channel))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logging.info(
+            f"Restored {len(resuming)} music players and {len(self.parked)} parked queues from "
+            f"{len(states)} snapshots in {elapsed_ms:.0f} ms ({read_ms:.0f} ms reading)."
+        )
+        if elapsed_ms > PLAYER_RESTORE_TARGET_MS:
+            logging.warning(f"Music player restore took longer than the {PLAYER_RESTORE_TARGET_MS:.0f} ms target.")
+
+        # Voice connections are the slow part; a bounded number open at a time
+        semaphore = asyncio.Semaphore(PLAYER_RESTORE_CONCURRENCY)
+
+        async def resume(player, voice_channel):
+            async with semaphore:
+                try:
+                    await player.reconnect(voice_channel)
+                except Exception as e:
+                    logging.error(f"Error resuming music player in {player.guild.id}: {e}")
+
+        await asyncio.gather(*(resume(player, voice_channel) for player, voice_channel in resuming))
+
+    @commands.command(name="play", help="Plays a song from YouTube, Spotify, or SoundCloud, or every song of an M3U/PLS playlist.")
     async def play(self, ctx, *, song_url):
-        server_id = ctx.guild.id
-        if server_id not in self.music_players:
-            self.music_players[server_id] = MusicPlayer(ctx)
-        player = self.music_players[server_id]
-        await player.join_voice_channel()
-        await player.add_to_queue(song_url)
+        player = await self.get_player(ctx)
+        await player.join_voice_channel(ctx.author)
+        if is_playlist(song_url):
+            if player.voice_client is not None:
+                player.start_playlist_import(song_url, ctx.author.id)
+            return
+        await player.add_to_queue(song_url, ctx.author.id)
 
-        if not player.voice_client.is_playing():
+        if not player._is_active():  # A paused song resumes with !resume instead
             await player.play_music()
 
     @commands.command(name="stop", help="Stops the currently playing song.")
@@ -202,18 +754,29 @@ class MusicCog(commands.Cog, name="Music"):
             player = self.music_players[server_id]
             await player.skip_music()
 
-    @commands.command(name="queue", help="Shows the current playback queue.")
-    async def queue(self, ctx):
+    @commands.command(name="queue", help="Shows a page of the playback queue.")
+    async def queue(self, ctx, page: int = 1):
         server_id = ctx.guild.id
         if server_id in self.music_players:
             player = self.music_players[server_id]
-            queue = player.get_queue()
-            if len(queue) > 0:
-                await ctx.send(f"Queue: {', '.join(queue)}")
+            if len(player.get_queue()) > 0:
+                outbound.post(ctx.channel, player.queue_pages.render(page))
             else:
-                await ctx.send("Queue is empty.")
+                outbound.post(ctx.channel, "Queue is empty.")
         else:
-            await ctx.send("No music player is active on this server.")
+            outbound.post(ctx.channel, "No music player is active on this server.")
+
+    @commands.command(name="queue_at", help="Shows the page of the queue containing an index.")
+    async def queue_at(self, ctx, index: int):
+        server_id = ctx.guild.id
+        if server_id in self.music_players:
+            player = self.music_players[server_id]
+            if len(player.get_queue()) > 0:
+                outbound.post(ctx.channel, player.queue_pages.render(player.queue_pages.page_of(max(index, 0))))
+            else:
+                outbound.post(ctx.channel, "Queue is empty.")
+        else:
+            outbound.post(ctx.channel, "No music player is active on this server.")
 
     @commands.command(name="remove", help="Removes a song from the queue by index.")
     async def remove(self, ctx, index: int):
@@ -222,7 +785,34 @@ class MusicCog(commands.Cog, name="Music"):
             player = self.music_players[server_id]
             await player.remove_from_queue(index)
         else:
-            await ctx.send("No music player is active on this server.")
+            outbound.post(ctx.channel, "No music player is active on this server.")
+
+    @commands.command(name="move", help="Moves a song in the queue from one index to another.")
+    async def move(self, ctx, source: int, destination: int):
+        server_id = ctx.guild.id
+        if server_id in self.music_players:
+            player = self.music_players[server_id]
+            await player.move_in_queue(source, destination)
+        else:
+            outbound.post(ctx.channel, "No music player is active on this server.")
+
+    @commands.command(name="shuffle", help="Shuffles the playback queue.")
+    async def shuffle(self, ctx):
+        server_id = ctx.guild.id
+        if server_id in self.music_players:
+            player = self.music_players[server_id]
+            await player.shuffle_queue()
+        else:
+            outbound.post(ctx.channel, "No music player is active on this server.")
+
+    @commands.command(name="dedupe", help="Removes duplicate songs from the queue.")
+    async def dedupe(self, ctx):
+        server_id = ctx.guild.id
+        if server_id in self.music_players:
+            player = self.music_players[server_id]
+            await player.dedupe_queue()
+        else:
+            outbound.post(ctx.channel, "No music player is active on this server.")
 
     @commands.command(name="clear", help="Clears the entire playback queue.")
     async def clear(self, ctx):
@@ -231,15 +821,12 @@ class MusicCog(commands.Cog, name="Music"):
             player = self.music_players[server_id]
             await player.clear_queue()
         else:
-            await ctx.send("No music player is active on this server.")
+            outbound.post(ctx.channel, "No music player is active on this server.")
 
     @commands.command(name="join", help="Connects the bot to your voice channel.")
     async def join(self, ctx):
-        server_id = ctx.guild.id
-        if server_id not in self.music_players:
-            self.music_players[server_id] = MusicPlayer(ctx)
-        player = self.music_players[server_id]
-        await player.join_voice_channel()
+        player = await self.get_player(ctx)
+        await player.join_voice_channel(ctx.author)
 
     @commands.command(name="leave", help="Disconnects the bot from the voice channel.")
     async def leave(self, ctx):
@@ -248,7 +835,7 @@ class MusicCog(commands.Cog, name="Music"):
             player = self.music_players[server_id]
             await player.leave_voice_channel()
         else:
-            await ctx.send("Not connected to any voice channel.")
+            outbound.post(ctx.channel, "Not connected to any voice channel.")
 
     @commands.command(name="volume", help="Sets the playback volume (0-100).")
     async def volume(self, ctx, volume: int):
@@ -257,7 +844,7 @@ class MusicCog(commands.Cog, name="Music"):
             player = self.music_players[server_id]
             await player.adjust_volume(volume)
         else:
-            await ctx.send("No music player is active on this server.")
+            outbound.post(ctx.channel, "No music player is active on this server.")
 
     @commands.command(name="quality", help="Sets the playback quality (high, medium, low).")
     async def quality(self, ctx, quality: str):
@@ -266,7 +853,53 @@ class MusicCog(commands.Cog, name="Music"):
             player = self.music_players[server_id]
             await player.set_playback_quality(quality)
         else:
-            await ctx.send("No music player is active on this server.")
-
-def setup(bot):
-    bot.add_cog(MusicCog(bot))
\ No newline at end of file
+            outbound.post(ctx.channel, "No music player is active on this server.")
+
+    @commands.command(name="cache_stats", help="Shows track metadata and audio cache statistics.")
+    @commands.is_owner()
+    async def cache_stats(self, ctx):
+        stats = resolver.stats()
+        lines = [
+            f"Track metadata: {stats['entries']} cached, hit ratio {stats['hit_ratio']:.1%}, "
+            f"{stats['in_flight']} lookups in flight."
+        ]
+        if audio_cache is None:
+            lines.append("The audio cache is disabled.")
+        else:
+            stats = audio_cache.stats()
+            lines.append(
+                f"Audio cache: {stats['files']} tracks, {stats['bytes'] / 1024 ** 2:.1f} of "
+                f"{stats['max_bytes'] / 1024 ** 2:.0f} MiB, hit ratio {stats['hit_ratio']:.1%}, "
+                f"{stats['bytes_saved'] / 1024 ** 2:.1f} MiB served from cache."
+            )
+        outbound.post(ctx.channel, "\n".join(lines))
+
+    @commands.command(name="players", help="Shows music player count and memory use.")
+    @commands.is_owner()
+    async def players(self, ctx):
+        sizes = {guild_id: player.approx_bytes() for guild_id, player in self.music_players.items()}
+        parked_bytes = sum(len(data) for data in self.parked.values())
+        lines = [
+            f"Music players: {len(sizes)} active, {sum(sizes.values()) / 1024:.1f} KiB; "
+            f"{len(self.parked)} parked, {parked_bytes / 1024:.1f} KiB."
+        ]
+        for guild_id, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:10]:
+            lines.append(f"`{guild_id}` {size / 1024:.1f} KiB, {len(self.music_players[guild_id].queue)} queued")
+        outbound.post(ctx.channel, "\n".join(lines))
+
+    @commands.command(name="transcoders", help="Shows FFmpeg process usage.")
+    @commands.is_owner()
+    async def transcoders(self, ctx):
+        stats = transcoder.stats()
+        lines = [
+            f"FFmpeg processes: {stats['active']}/{stats['max_processes']} running, {stats['waiting']} waiting, "
+            f"{stats['cpu_seconds']:.1f} CPU seconds, {stats['rss_bytes'] / 1024 ** 2:.1f} MiB RSS "
+            f"across {len(stats['guilds'])} servers."
+        ]
+        if audio_workers is not None:
+            stats = audio_workers.stats()
+            lines.append(f"Audio workers: {stats['workers']} processes carrying {stats['streams']} streams.")
+        outbound.post(ctx.channel, "\n".join(lines))
+
+async def setup(bot):
+    await bot.add_cog(MusicCog(bot))
\ No newline at end of file
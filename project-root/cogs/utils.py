@@ -2,7 +2,7 @@ import discord
 from discord.ext import commands
 import logging
 
-logging.basicConfig(level=logging.INFO)
+from core import CachedMemberConverter, member_cache
 
 class UtilityCog(commands.Cog, name="Utilities"):
     def __init__(self, bot: commands.Bot):
@@ -14,7 +14,7 @@ class UtilityCog(commands.Cog, name="Utilities"):
         await ctx.send(f"Pong! Latency: {round(self.bot.latency * 1000)}ms")
 
     @commands.command(name="get_user", help="Get information about a user by mentioning them.")
-    async def get_user(self, ctx: commands.Context, user: discord.Member):
+    async def get_user(self, ctx: commands.Context, user: CachedMemberConverter):
         """Retrieves user information and displays it in a formatted message."""
         embed = discord.Embed(title=f"User Information - {user.name}", color=discord.Color.blue())
         embed.add_field(name="Username", value=user.name, inline=True)
@@ -44,7 +44,11 @@ class UtilityCog(commands.Cog, name="Utilities"):
         embed.add_field(name="Role ID", value=role.id, inline=True)
         embed.add_field(name="Role Color", value=role.color, inline=True)
         embed.add_field(name="Role Position", value=role.position, inline=True)
-        embed.add_field(name="Members", value=len(role.members), inline=True)
+        if member_cache.policy == "all" and role.guild.chunked:
+            embed.add_field(name="Members", value=len(role.members), inline=True)
+        else:
+            # role.members only sees the members MEMBER_CACHE_POLICY keeps, so the count is a lower bound
+            embed.add_field(name="Members (cached)", value=len(role.members), inline=True)
         embed.add_field(name="Hoisted", value=role.hoist, inline=True)
         embed.add_field(name="Mentionable", value=role.mentionable, inline=True)
         embed.add_field(name="Created At", value=role.created_at.strftime("%Y-%m-%d %H:%M:%S"), inline=False)
@@ -76,5 +80,5 @@ class UtilityCog(commands.Cog, name="Utilities"):
         logging.info(f"Event: {message}")
         await ctx.send(f"Event logged: {message}")
 
-def setup(bot: commands.Bot):
-    bot.add_cog(UtilityCog(bot))
\ No newline at end of file
+async def setup(bot: commands.Bot):
+    await bot.add_cog(UtilityCog(bot))
\ No newline at end of file
@@ -0,0 +1,9 @@
+from dotenv import load_dotenv
+
+load_dotenv()  # The modules below read their settings from the environment on import
+
+from .logs import ThrottledErrors, bind_command, setup_logging
+from .members import CachedMemberConverter, MemberCache, member_cache
+from .metrics import MetricsRegistry, registry
+from .outbound import NORMAL, URGENT, OutboundScheduler, TokenBucket, outbound
+from .profiling import LoopMonitor, loop_monitor, sample_stacks
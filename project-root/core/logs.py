@@ -0,0 +1,116 @@
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+from .metrics import registry
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_ERROR_BURST = int(os.getenv("LOG_ERROR_BURST", "5"))
+LOG_ERROR_PERIOD = float(os.getenv("LOG_ERROR_PERIOD", "60"))
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+FIELDS = ("guild_id", "command", "duration")  # Structured fields appended to a record as key=value
+
+DROPPED_RECORDS = registry.counter("log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+# (server id, command name) of the command running in the current task, and
+# in the tasks it starts; set for every command by main.py's before_invoke hook
+command_context = contextvars.ContextVar("command_context", default=None)
+
+def bind_command(ctx):
+    """Tags the log records of the rest of this command with its server and name."""
+    command_context.set((ctx.guild.id if ctx.guild else None, ctx.command.qualified_name if ctx.command else None))
+
+class _ContextFilter(logging.Filter):
+    # Runs in the thread that logs, where the command context is visible
+    def filter(self, record):
+        context = command_context.get()
+        if context is not None:
+            if getattr(record, "guild_id", None) is None:
+                record.guild_id = context[0]
+            if getattr(record, "command", None) is None:
+                record.command = context[1]
+        return True
+
+class StructuredFormatter(logging.Formatter):
+    """Appends the structured fields a record carries (guild_id, command, duration) as key=value pairs."""
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        fields = []
+        for name in FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                fields.append(f"{name}={value * 1000:.1f}ms" if name == "duration" else f"{name}={value}")
+        return f"{line} {' '.join(fields)}" if fields else line
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Drops records when the writer thread has fallen behind instead of blocking the caller
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_RECORDS.inc()
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL):
+    """Routes every log record through a queue to one writer thread.
+
+    Logging calls only format the record and put it on the queue, so a slow
+    stdout/stderr (e.g. a container log driver applying backpressure) never
+    blocks the event loop. Records still queued are written at exit.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(LOG_FORMAT))
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(_ContextFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+class ThrottledErrors:
+    """Logs errors that repeat (the same failure for every server or every song) at a bounded rate.
+
+    Each key gets at most `burst` records per `period` seconds; the rest are
+    counted, and the count is added to the next record logged for that key.
+    """
+
+    def __init__(self, logger, burst=LOG_ERROR_BURST, period=LOG_ERROR_PERIOD):
+        self.logger = logger
+        self.burst = burst
+        self.period = period
+        self._windows = {}  # key -> [window start, records logged, records suppressed]
+        self._lock = threading.Lock()  # Errors may come from player threads too
+
+    def error(self, key, message, **fields):
+        """Logs message under key unless key has used up its burst; fields become structured fields."""
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[key] = [now, 0, suppressed]
+            if window[1] >= self.burst:
+                window[2] += 1
+                return
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+        if suppressed:
+            message = f"{message} ({suppressed} similar errors suppressed)"
+        self.logger.error(message, extra=fields)
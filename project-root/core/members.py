@@ -0,0 +1,104 @@
+import os
+import re
+import time
+from collections import OrderedDict
+
+import discord
+from discord.ext import commands
+
+# Which members the gateway cache keeps. "all" keeps every member of every server
+# (the old behaviour), "voice" only members in a voice channel, and "lazy" none at
+# all; members the cache does not hold are fetched when a command needs them.
+_CACHE_FLAGS = {
+    "all": discord.MemberCacheFlags.all,
+    "voice": lambda: discord.MemberCacheFlags(voice=True, joined=False),
+    "lazy": discord.MemberCacheFlags.none,
+}
+
+class MemberCache:
+    """Member cache policy plus a small LRU of members fetched on demand.
+
+    Under the "voice" and "lazy" policies, members looked up by commands are
+    kept here for `ttl` seconds (at most `max_entries` of them) rather than in
+    the gateway cache. Under "all", servers are chunked the first time a
+    command looks a member up in them instead of all at once at startup.
+    """
+
+    def __init__(self, policy="voice", max_entries=1000, ttl=300, chunk_at_startup=False):
+        self.policy = policy
+        self.cache_flags = _CACHE_FLAGS[policy]()
+        self.chunk_at_startup = chunk_at_startup and policy == "all"
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._members = OrderedDict()  # (server id, user id) -> (member, expiry)
+
+    @property
+    def chunk_lazily(self):
+        return self.policy == "all" and not self.chunk_at_startup
+
+    def get(self, guild_id, user_id):
+        entry = self._members.get((guild_id, user_id))
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self._members.move_to_end((guild_id, user_id))
+        self.hits += 1
+        return entry[0]
+
+    def remember(self, member):
+        if self.policy == "all" or self.max_entries <= 0:
+            return  # The gateway cache already holds it
+        key = (member.guild.id, member.id)
+        self._members[key] = (member, time.monotonic() + self.ttl)
+        self._members.move_to_end(key)
+        while len(self._members) > self.max_entries:
+            self._members.popitem(last=False)
+
+    def forget(self, guild_id, user_id):
+        """Drops a member whose roles or membership a command just changed."""
+        self._members.pop((guild_id, user_id), None)
+
+    def stats(self):
+        """Returns the LRU counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "policy": self.policy,
+            "entries": len(self._members),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+class CachedMemberConverter(commands.MemberConverter):
+    """MemberConverter that checks the member LRU first and remembers what it fetches.
+
+    Members missing from the gateway cache are fetched the way discord.py's
+    converter does (a gateway member query, or the HTTP API while the gateway
+    is rate limited) and kept in the LRU for the next command.
+    """
+
+    async def convert(self, ctx, argument):
+        guild = ctx.guild
+        if guild is not None:
+            if member_cache.chunk_lazily and not guild.chunked:
+                await guild.chunk()
+            match = self._get_id_match(argument) or re.match(r"<@!?([0-9]{15,20})>$", argument)
+            if match is not None and guild.get_member(int(match.group(1))) is None:
+                member = member_cache.get(guild.id, int(match.group(1)))
+                if member is not None:
+                    return member
+        member = await super().convert(ctx, argument)
+        if guild is not None and guild.get_member(member.id) is None:
+            member_cache.remember(member)
+        return member
+
+# Shared by main.py (cache flags) and every cog that converts members
+member_cache = MemberCache(
+    policy=os.getenv("MEMBER_CACHE_POLICY", "voice").lower(),
+    max_entries=int(os.getenv("MEMBER_LRU_SIZE", "1000")),
+    ttl=float(os.getenv("MEMBER_LRU_TTL", "300")),
+    chunk_at_startup=os.getenv("MEMBER_CHUNK_AT_STARTUP", "false").lower() == "true",
+)
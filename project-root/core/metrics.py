@@ -0,0 +1,203 @@
+import bisect
+import logging
+import math
+
+# Latency buckets in seconds, from a cache hit to a slow network round trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class CounterChild:
+    """One labelled series of a counter. inc() is a plain attribute update, with no lock.
+
+    Updates are meant to come from the event loop thread; a value touched from
+    several threads at once may rarely miss an increment, which metrics tolerate.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+class HistogramChild:
+    """One labelled series of a histogram; observe() bumps one bucket, the sum and the count."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Per bucket, not cumulative; the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric:
+    """A metric family. labels() returns the series for a set of label values, creating it once.
+
+    Callers on a hot path bind their series once (e.g. at import) and keep it,
+    so recording is a single attribute update. A family without label names
+    records directly through inc()/set()/observe().
+    """
+
+    def __init__(self, name, help, kind, labelnames=(), buckets=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self._children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        if self.kind == "counter":
+            return CounterChild()
+        if self.kind == "gauge":
+            return GaugeChild()
+        return HistogramChild(self.buckets)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        """Yields (suffix, labels, value) for every series."""
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            if self.kind != "histogram":
+                yield "", labels, child.value
+                continue
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                cumulative += count
+                yield "_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield "_sum", labels, child.sum
+            yield "_count", labels, child.count
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    return repr(float(value))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text format.
+
+    Values that already exist elsewhere (cache counters, process counts, queue
+    lengths) are read by collectors at scrape time instead of being updated on
+    every change. A collector returns (name, kind, help, [(labels, value), ...]).
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._runner = None
+
+    def _register(self, name, help, kind, labelnames, buckets=None):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Metric(name, help, kind, labelnames, buckets)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(name, help, "counter", labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(name, help, "gauge", labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(name, help, "histogram", labelnames, buckets)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        for collector in list(self._collectors):
+            try:
+                families = list(collector())
+            except Exception as e:
+                logging.error(f"Error collecting metrics from {collector}: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        return web.Response(body=self.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def start(self, host, port):
+        """Serves GET /metrics on host:port."""
+        from aiohttp import web  # Only loaded when the endpoint is turned on
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+# Shared by every module that records metrics; served by the Metrics cog
+registry = MetricsRegistry()
@@ -0,0 +1,177 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+from .metrics import registry
+
+# Priorities: lower is sent first. Errors go ahead of informational chatter.
+URGENT = 0
+NORMAL = 1
+
+# Discord's message length limit
+MAX_MESSAGE_LENGTH = 2000
+
+RATE_LIMIT_WAIT_SECONDS = registry.histogram(
+    "outbound_rate_limit_wait_seconds", "Time a message waited for a rate limit token before it was sent."
+)
+
+class TokenBucket:
+    """Allows `capacity` sends at once, refilled at `rate` per second."""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class _Notice:
+    __slots__ = ("content", "kwargs", "coalesce", "future")
+
+    def __init__(self, content, kwargs, coalesce, future):
+        self.content = content
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.future = future
+
+class OutboundScheduler:
+    """Sends bot messages through per-channel token buckets instead of straight to Discord.
+
+    post() queues a message and returns at once, so commands never wait on
+    a rate limit. Each channel with queued messages has one sender task that
+    takes the most urgent message first, waits a short window for more
+    plain-text notices and merges them into one message, and only sends when
+    the channel's bucket (and the bot-wide bucket) has a token.
+    """
+
+    def __init__(self, per_channel=5, per_channel_period=5.0, global_rate=45, coalesce_window=0.15):
+        self.per_channel = per_channel
+        self.per_channel_period = per_channel_period
+        self.coalesce_window = coalesce_window
+        self.sent = 0
+        self.merged = 0  # Notices folded into another message instead of sent on their own
+        self._global = TokenBucket(global_rate, global_rate)
+        self._queues = {}  # channel id -> heap of (priority, sequence, notice)
+        self._buckets = {}  # channel id -> TokenBucket, pruned once refilled
+        self._prune_at = 1000
+        self._senders = {}  # channel id -> sender task
+        self._sequence = itertools.count()
+
+    def post(self, channel, content=None, *, priority=NORMAL, coalesce=True, **kwargs):
+        """Queues a message; returns a future for the sent discord.Message (None if sending failed).
+
+        Plain-text notices with coalesce=True may be merged with others for the
+        same channel. Messages with an embed, file or other options are sent alone.
+        """
+        future = asyncio.get_running_loop().create_future()
+        notice = _Notice(content, kwargs, coalesce and not kwargs and content is not None, future)
+        heapq.heappush(self._queues.setdefault(channel.id, []), (priority, next(self._sequence), notice))
+        if channel.id not in self._senders:
+            self._senders[channel.id] = asyncio.create_task(self._run(channel))
+        return future
+
+    def _bucket(self, channel_id):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune()
+            bucket = self._buckets[channel_id] = TokenBucket(self.per_channel, self.per_channel / self.per_channel_period)
+        return bucket
+
+    def _prune(self):
+        """Drops the buckets of quiet channels; a full bucket is the same as a new one."""
+        for channel_id, bucket in list(self._buckets.items()):
+            if channel_id not in self._senders and bucket.wait_time() == 0 and bucket.tokens >= bucket.capacity:
+                del self._buckets[channel_id]
+        self._prune_at = max(1000, 2 * len(self._buckets))
+
+    async def _run(self, channel):
+        queue = self._queues[channel.id]
+        bucket = self._bucket(channel.id)
+        try:
+            while queue:
+                priority, _, notice = queue[0]
+                if notice.coalesce and priority != URGENT:
+                    await asyncio.sleep(self.coalesce_window)  # Let a burst of notices arrive
+                wait = max(bucket.wait_time(), self._global.wait_time())
+                if wait > 0:
+                    waited_from = time.monotonic()
+                    while wait > 0:
+                        await asyncio.sleep(wait)
+                        wait = max(bucket.wait_time(), self._global.wait_time())
+                    RATE_LIMIT_WAIT_SECONDS.observe(time.monotonic() - waited_from)
+                bucket.take()
+                self._global.take()
+                await self._send(channel, self._take_batch(queue))
+        finally:
+            del self._senders[channel.id]
+            if not queue:
+                del self._queues[channel.id]
+
+    def _take_batch(self, queue):
+        """Pops the next message, merged with the plain-text notices behind it that fit."""
+        _, _, first = heapq.heappop(queue)
+        batch = [first]
+        if not first.coalesce:
+            return batch
+        length = len(first.content)
+        while queue and queue[0][2].coalesce and length + 1 + len(queue[0][2].content) <= MAX_MESSAGE_LENGTH:
+            _, _, notice = heapq.heappop(queue)
+            batch.append(notice)
+            length += 1 + len(notice.content)
+        return batch
+
+    async def _send(self, channel, batch):
+        if len(batch) > 1:
+            content = "\n".join(notice.content for notice in batch)
+            kwargs = {}
+            self.merged += len(batch) - 1
+        else:
+            content, kwargs = batch[0].content, batch[0].kwargs
+        try:
+            message = await channel.send(content, **kwargs)
+            self.sent += 1
+        except Exception as e:
+            logging.error(f"Error sending message to channel {channel.id}: {e}")
+            message = None
+        for notice in batch:
+            if not notice.future.done():
+                notice.future.set_result(message)
+
+    def post_threadsafe(self, loop, channel, content=None, **kwargs):
+        """post() from a thread other than the event loop's (e.g. a voice player thread)."""
+        loop.call_soon_threadsafe(lambda: self.post(channel, content, **kwargs))
+
+    def stats(self):
+        """Returns the scheduler counters as a dictionary."""
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "channels": len(self._senders),
+        }
+
+    async def drain(self, timeout=5.0):
+        """Waits (up to timeout seconds) for every queued message to be sent, e.g. before shutdown."""
+        senders = list(self._senders.values())
+        if senders:
+            await asyncio.wait(senders, timeout=timeout)
+
+# Shared by every cog; Discord allows 5 messages per 5 seconds per channel
+outbound = OutboundScheduler(
+    per_channel=int(os.getenv("OUTBOUND_CHANNEL_BURST", "5")),
+    per_channel_period=float(os.getenv("OUTBOUND_CHANNEL_PERIOD", "5")),
+    coalesce_window=float(os.getenv("OUTBOUND_COALESCE_WINDOW", "0.15")),
+)
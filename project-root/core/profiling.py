@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+import discord
+
+from .metrics import registry
+
+LOOP_LAG_SECONDS = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop wakes up from a short sleep.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+class LoopMonitor:
+    """Measures event-loop lag continuously and logs what the loop is stuck on.
+
+    A task on the loop records a heartbeat every `interval` seconds. A watchdog
+    thread checks the heartbeat, and once the loop has not come back for
+    `threshold` seconds it logs the running task and the loop thread's stack,
+    once per stall, while the blocking call is still on the stack.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Starts monitoring the running event loop."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._beat())
+        if self.threshold > 0:
+            threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stopping.set()
+
+    async def _beat(self):
+        while True:
+            started = self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        reported = None  # Heartbeat of the stall already logged
+        while not self._stopping.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            task = asyncio.current_task(self._loop)
+            running = f"task {task.get_name()} ({task.get_coro().__qualname__})" if task is not None else "a callback outside any task"
+            logging.warning(f"Event loop blocked for {blocked * 1000:.0f} ms in {running}:\n{stack}")
+
+_sampling = threading.Lock()  # One profile at a time, since it changes the switch interval
+
+def _thread_label(thread, loop_thread):
+    if thread.ident == loop_thread:
+        return "event-loop"
+    if isinstance(thread, discord.player.AudioPlayer):
+        guild = getattr(thread.client, "guild", None)
+        return f"player-{guild.id}" if guild is not None else "player"
+    return None
+
+def sample_stacks(seconds, loop_thread, interval=0.005):
+    """Samples the event loop and voice player threads for `seconds`.
+
+    Returns the stacks in collapsed format ("thread;outer;...;inner count" per
+    line), which flamegraph.pl, speedscope and similar tools read directly.
+    """
+    with _sampling:
+        # The sampler needs the GIL to read a stack; with the default 5 ms switch
+        # interval it would only get it when the loop waits for I/O, and every
+        # sample would land in select()
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, interval / 20))
+        try:
+            return _sample(seconds, loop_thread, interval)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+def _sample(seconds, loop_thread, interval):
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        labels = {}
+        for thread in threading.enumerate():
+            label = _thread_label(thread, loop_thread)
+            if label is not None:
+                labels[thread.ident] = label
+        for ident, frame in sys._current_frames().items():
+            label = labels.get(ident)
+            if label is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            stack.append(label)
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+# Started by main.py's setup_hook; LOOP_LAG_THRESHOLD_MS=0 turns the stall log off
+loop_monitor = LoopMonitor(threshold=float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250")) / 1000)
@@ -1,7 +1,9 @@
 from .models import Database
+from .player_state import create_player_state_store
 
-# Initialize the database connection
+# Initialize the database handle; the connection pool is opened (and the
+# tables or collections created) on first use, inside the bot's event loop
 database = Database()
 
-# Create tables or collections if they don't exist
-database.create_tables()
\ No newline at end of file
+# Where music players snapshot their queues so restarts and reloads can resume them
+player_states = create_player_state_store(database)
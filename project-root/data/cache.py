@@ -0,0 +1,98 @@
+import os
+import time
+from collections import OrderedDict
+
+class GuildConfig:
+    """Cached settings row for one server."""
+
+    __slots__ = ("prefix", "music_channel", "log_channel", "expires_at")
+
+    def __init__(self, prefix=None, music_channel=None, log_channel=None, expires_at=None):
+        self.prefix = prefix
+        self.music_channel = music_channel
+        self.log_channel = log_channel
+        self.expires_at = expires_at
+
+class GuildConfigCache:
+    """Bounded LRU cache of per-server settings with an optional time-to-live."""
+
+    def __init__(self, max_size=10000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl  # Seconds; None keeps entries until they are evicted
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefix_initials = None  # First characters of every stored prefix, once loaded
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, server_id):
+        return server_id in self._entries
+
+    def get(self, server_id):
+        """Returns the cached settings for a server, or None on a miss."""
+        entry = self._entries.get(server_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            del self._entries[server_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(server_id)
+        self.hits += 1
+        return entry
+
+    def put(self, server_id, prefix=None, music_channel=None, log_channel=None):
+        """Stores a complete settings row for a server, evicting the least recently used one if full."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self.note_prefix(prefix)
+        self._entries[server_id] = GuildConfig(prefix, music_channel, log_channel, expires_at)
+        self._entries.move_to_end(server_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return self._entries[server_id]
+
+    def update(self, server_id, **fields):
+        """Applies a write to a cached row; servers that are not cached are left to the next read."""
+        if "prefix" in fields:
+            self.note_prefix(fields["prefix"])
+        entry = self._entries.get(server_id)
+        if entry is None:
+            return
+        for field, value in fields.items():
+            setattr(entry, field, value)
+
+    def note_prefix(self, prefix):
+        """Records the first character of a prefix that is in use somewhere."""
+        if prefix and self.prefix_initials is not None:
+            self.prefix_initials.add(prefix[0])
+
+    def invalidate(self, server_id):
+        """Drops a server's cached settings."""
+        self._entries.pop(server_id, None)
+
+    def clear(self):
+        """Drops every cached entry."""
+        self._entries.clear()
+
+    def stats(self):
+        """Returns the cache counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+# Shared by every Database instance so writes made through one are seen by all readers
+guild_configs = GuildConfigCache(
+    max_size=int(os.getenv("CONFIG_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("CONFIG_CACHE_TTL", "600")) or None,
+)
@@ -1,47 +1,222 @@
 import os
-import psycopg2
-import pymongo
+import time
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
 from dotenv import load_dotenv
 
+from core.logs import ThrottledErrors
+from core.metrics import registry
+from .cache import guild_configs
+
 load_dotenv()
 
+# Columns of the servers table that set_server_channel/get_server_channel may touch
+CHANNEL_ACTIONS = ("music", "log")
+
+QUERY_SECONDS = registry.histogram(
+    "database_query_duration_seconds", "Duration of Database calls that reach the database.", ("method",)
+)
+ERRORS = registry.counter("database_errors_total", "Failed Database calls.", ("method",))
+
+logger = logging.getLogger(__name__)
+# An unreachable database fails every call the same way; those errors are rate limited
+errors = ThrottledErrors(logger)
+_call_started = contextvars.ContextVar("call_started", default=None)  # perf_counter() at the start of the timed call
+
+# Seconds to wait before reconnecting after a failed connect; doubles per failure up to the maximum
+CONNECT_RETRY_MIN = 1
+CONNECT_RETRY_MAX = 60
+
+def timed(method):
+    """Records each call's duration (and any exception it raises) under method in the database metrics."""
+    def decorator(function):
+        duration = QUERY_SECONDS.labels(method)
+        failures = ERRORS.labels(method)
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            token = _call_started.set(started)
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                failures.inc()
+                raise
+            finally:
+                _call_started.reset(token)
+                duration.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
 class Database:
     def __init__(self):
         self.database_url = os.getenv("DATABASE_URL")
         self.database_type = os.getenv("DATABASE_TYPE", "postgresql")  # Default to PostgreSQL
 
-        self.connection = None  # Initialize connection as None
+        # Connection pool bounds and per-call timeout (seconds)
+        self.pool_min_size = int(os.getenv("DATABASE_POOL_MIN_SIZE", "1"))
+        self.pool_max_size = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+        self.query_timeout = float(os.getenv("DATABASE_QUERY_TIMEOUT", "5"))
 
-        if self.database_type.lower() == "postgresql":
-            self.connect_postgresql()
-        elif self.database_type.lower() == "mongodb":
-            self.connect_mongodb()
+        # Write-behind mode: settings writes are coalesced per server and flushed in batches
+        # Without a database there is nothing to flush to, so writes stay write-through (and fail fast)
+        self.write_behind = os.getenv("DATABASE_WRITE_BEHIND", "false").lower() == "true" and bool(self.database_url)
+        self.flush_interval = float(os.getenv("DATABASE_FLUSH_INTERVAL", "1"))
+        self.flush_threshold = int(os.getenv("DATABASE_FLUSH_THRESHOLD", "500"))
+        self._pending = {}  # server_id -> {column: value} waiting to be flushed
+        self._flush_now = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+        self.connection = None  # Pool (PostgreSQL) or client (MongoDB), opened lazily by connect()
+        self._connect_lock = asyncio.Lock()
+        self._retry_delay = 0  # Backoff after the last failed connect, in seconds
+        self._retry_at = 0.0  # monotonic() time before which connect() does not try again
+        self.cache = guild_configs  # Per-server settings kept in memory in front of the database
+        self._warmed = False  # Whether warm_cache read every row, so an uncached server has none
+        self._versions = {}  # server_id -> number of write-through writes, to spot reads that raced one
 
-    def connect_postgresql(self):
+    def _error(self, method, message, server_id=None):
+        """Counts a failed call of method in the database metrics and logs it, rate limited per method."""
+        ERRORS.labels(method).inc()
+        started = _call_started.get()
+        duration = time.perf_counter() - started if started is not None else None
+        errors.error(method, message, guild_id=server_id, duration=duration)
+
+    async def connect(self):
+        """Opens the connection pool for the configured database and creates the tables.
+
+        Does nothing without DATABASE_URL. After a failed attempt, calls return
+        at once (leaving connection None) until the backoff has passed, so an
+        unreachable database is not retried by every waiting call in turn.
+        """
+        if self.connection is not None or not self.database_url or time.monotonic() < self._retry_at:
+            return
+        async with self._connect_lock:
+            if self.connection is not None or time.monotonic() < self._retry_at:
+                return
+            if self.database_type.lower() == "postgresql":
+                await self.connect_postgresql()
+            elif self.database_type.lower() == "mongodb":
+                await self.connect_mongodb()
+            if self.connection is None:
+                self._retry_delay = min(max(self._retry_delay * 2, CONNECT_RETRY_MIN), CONNECT_RETRY_MAX)
+                self._retry_at = time.monotonic() + self._retry_delay
+                logger.warning(f"Database unavailable; next connection attempt in {self._retry_delay}s.")
+                return
+            self._retry_delay = 0
+            await self.create_tables()
+
+    async def connect_postgresql(self):
         """Connects to the PostgreSQL database."""
+        import asyncpg  # Imported here so a MongoDB deployment never loads it (and vice versa)
+
         try:
-            self.connection = psycopg2.connect(self.database_url)
-            self.cursor = self.connection.cursor()
-            print("Connected to PostgreSQL database.")
+            self.connection = await asyncio.wait_for(
+                asyncpg.create_pool(
+                    self.database_url,
+                    min_size=self.pool_min_size,
+                    max_size=self.pool_max_size,
+                    command_timeout=self.query_timeout,
+                ),
+                self.query_timeout,
+            )
+            logger.info("Connected to PostgreSQL database.")
         except Exception as e:
-            print(f"Error connecting to PostgreSQL database: {e}")
+            self._error("connect", f"Error connecting to PostgreSQL database: {e}")
 
-    def connect_mongodb(self):
+    async def connect_mongodb(self):
         """Connects to the MongoDB database."""
+        import motor.motor_asyncio
+
         try:
-            self.connection = pymongo.MongoClient(self.database_url)
+            timeout_ms = int(self.query_timeout * 1000)
+            self.connection = motor.motor_asyncio.AsyncIOMotorClient(
+                self.database_url,
+                minPoolSize=self.pool_min_size,
+                maxPoolSize=self.pool_max_size,
+                serverSelectionTimeoutMS=timeout_ms,
+                socketTimeoutMS=timeout_ms,
+                waitQueueTimeoutMS=timeout_ms,
+            )
             self.db = self.connection["discord_music_bot"]
-            print("Connected to MongoDB database.")
+            logger.info("Connected to MongoDB database.")
         except Exception as e:
-            print(f"Error connecting to MongoDB database: {e}")
+            self._error("connect", f"Error connecting to MongoDB database: {e}")
+
+    async def _execute(self, query, *args):
+        """Runs a statement on a pooled PostgreSQL connection within the per-call timeout."""
+        async with self.connection.acquire(timeout=self.query_timeout) as conn:
+            return await conn.execute(query, *args, timeout=self.query_timeout)
+
+    async def _fetchrow(self, query, *args):
+        """Fetches one row on a pooled PostgreSQL connection within the per-call timeout."""
+        async with self.connection.acquire(timeout=self.query_timeout) as conn:
+            return await conn.fetchrow(query, *args, timeout=self.query_timeout)
+
+    async def _mongo(self, operation):
+        """Awaits a MongoDB operation within the per-call timeout."""
+        return await asyncio.wait_for(operation, self.query_timeout)
 
-    def create_tables(self):
+    async def _load_server_config(self, server_id):
+        """Returns a server's cached settings, reading its whole row into the cache on a miss."""
+        config = self.cache.get(server_id)
+        if config is not None:
+            return config
+        config = await self._read_server_config(server_id)
+        if config is not None:
+            # Writes still waiting in the write-behind buffer are newer than the row just read
+            self.cache.update(server_id, **self._pending.get(server_id, {}))
+        return config
+
+    @timed("read_server_config")
+    async def _read_server_config(self, server_id):
+        """Reads a server's row from the database into the cache."""
+        if not self.database_url:
+            return self.cache.put(server_id)  # No database: every server uses the defaults
+        await self.connect()
+        if self.database_type.lower() not in ("postgresql", "mongodb"):
+            return None
+        while True:
+            version = self._versions.get(server_id, 0)
+            row = await self._fetch_server_row(server_id)
+            # A write finished while the row was read, and cache.update skipped it (nothing was
+            # cached yet): the row may predate the write, so caching it would serve the old value
+            if self._versions.get(server_id, 0) == version:
+                break
+        # Servers without a row are cached too, so their lookups stay off the network
+        return self.cache.put(server_id, *row) if row else self.cache.put(server_id)
+
+    async def _fetch_server_row(self, server_id):
+        """Returns a server's (prefix, music_channel, log_channel), or None if it has no row."""
+        if self.database_type.lower() == "postgresql":
+            result = await self._fetchrow(
+                "SELECT prefix, music_channel, log_channel FROM servers WHERE server_id = $1",
+                server_id,
+            )
+            if result:
+                return result["prefix"], result["music_channel"], result["log_channel"]
+        else:
+            server_data = await self._mongo(self.db.servers.find_one({"server_id": server_id}))
+            if server_data:
+                return server_data.get("prefix"), server_data.get("music_channel"), server_data.get("log_channel")
+        return None
+
+    def _written(self, server_id, **fields):
+        """Applies a write that reached the database to the cache, and marks reads in flight as stale."""
+        self._versions[server_id] = self._versions.get(server_id, 0) + 1
+        self.cache.update(server_id, **fields)
+
+    async def create_tables(self):
         """Creates tables or collections in the database (if using PostgreSQL)."""
         if self.database_type.lower() == "postgresql":
             try:
                 # Create tables (if using PostgreSQL)
                 # Replace with your actual table creation queries
-                self.cursor.execute("""
+                await self._execute("""
                     CREATE TABLE IF NOT EXISTS servers (
                         server_id BIGINT PRIMARY KEY,
                         prefix VARCHAR(10),
@@ -49,126 +224,350 @@ class Database:
                         log_channel BIGINT
                     );
                 """)
-                self.cursor.execute("""
+                await self._execute("""
+                    CREATE TABLE IF NOT EXISTS player_state (
+                        server_id BIGINT PRIMARY KEY,
+                        state BYTEA NOT NULL
+                    );
+                """)
+                await self._execute("""
                     CREATE TABLE IF NOT EXISTS users (
                         user_id BIGINT PRIMARY KEY,
                         server_id BIGINT,
                         preferences JSONB
                     );
                 """)
-                self.connection.commit()
-                print("Tables created successfully.")
+                logger.info("Tables created successfully.")
             except Exception as e:
-                print(f"Error creating tables: {e}")
+                self._error("create_tables", f"Error creating tables: {e}")
 
-    def set_server_prefix(self, server_id, prefix):
+    @timed("set_server_prefix")
+    async def set_server_prefix(self, server_id, prefix):
         """Sets the command prefix for a server."""
+        if self.write_behind:
+            await self._queue_write(server_id, prefix=prefix)
+            logger.debug(f"Prefix set for server {server_id}: {prefix}")
+            return
+        await self.connect()
         if self.database_type.lower() == "postgresql":
             try:
-                self.cursor.execute(
-                    "INSERT INTO servers (server_id, prefix) VALUES (%s, %s) ON CONFLICT (server_id) DO UPDATE SET prefix = %s",
-                    (server_id, prefix, prefix),
+                await self._execute(
+                    "INSERT INTO servers (server_id, prefix) VALUES ($1, $2) ON CONFLICT (server_id) DO UPDATE SET prefix = $2",
+                    server_id, prefix,
                 )
-                self.connection.commit()
-                print(f"Prefix set for server {server_id}: {prefix}")
+                self._written(server_id, prefix=prefix)
+                logger.debug(f"Prefix set for server {server_id}: {prefix}")
             except Exception as e:
-                print(f"Error setting prefix: {e}")
+                self._error("set_server_prefix", f"Error setting prefix: {e}", server_id)
         elif self.database_type.lower() == "mongodb":
             try:
-                self.db.servers.update_one(
+                await self._mongo(self.db.servers.update_one(
                     {"server_id": server_id},
                     {"$set": {"prefix": prefix}},
                     upsert=True,
-                )
-                print(f"Prefix set for server {server_id}: {prefix}")
+                ))
+                self._written(server_id, prefix=prefix)
+                logger.debug(f"Prefix set for server {server_id}: {prefix}")
             except Exception as e:
-                print(f"Error setting prefix: {e}")
+                self._error("set_server_prefix", f"Error setting prefix: {e}", server_id)
 
-    def get_server_prefix(self, server_id):
+    async def get_server_prefix(self, server_id):
         """Retrieves the command prefix for a server."""
+        try:
+            config = await self._load_server_config(server_id)
+            return config.prefix if config else None
+        except Exception as e:
+            self._error("get_server_prefix", f"Error getting prefix: {e}", server_id)
+            return None
+
+    async def iter_server_configs(self, batch_size=1000):
+        """Streams every (server_id, prefix, music_channel, log_channel) row, fetching batch_size rows at a time."""
+        if not self.database_url:
+            return
+        await self.connect()
         if self.database_type.lower() == "postgresql":
-            try:
-                self.cursor.execute("SELECT prefix FROM servers WHERE server_id = %s", (server_id,))
-                result = self.cursor.fetchone()
-                if result:
-                    return result[0]
+            async with self.connection.acquire(timeout=self.query_timeout) as conn:
+                # Server-side cursors only live inside a transaction
+                async with conn.transaction(readonly=True):
+                    async for row in conn.cursor(
+                        "SELECT server_id, prefix, music_channel, log_channel FROM servers",
+                        prefetch=batch_size,
+                    ):
+                        yield row["server_id"], row["prefix"], row["music_channel"], row["log_channel"]
+        elif self.database_type.lower() == "mongodb":
+            cursor = self.db.servers.find(
+                {},
+                {"_id": 0, "server_id": 1, "prefix": 1, "music_channel": 1, "log_channel": 1},
+                batch_size=batch_size,
+            )
+            async for server_data in cursor:
+                yield (
+                    server_data.get("server_id"),
+                    server_data.get("prefix"),
+                    server_data.get("music_channel"),
+                    server_data.get("log_channel"),
+                )
+
+    @timed("warm_cache")
+    async def warm_cache(self, batch_size=1000, shard_count=None, shard_ids=None):
+        """Loads every server's settings into the cache so first lookups are hits; returns the row count.
+
+        With shard_ids, only the servers on those of shard_count shards are
+        cached, so a cluster worker fills its cache with its own servers and
+        not with those of the other processes. Warmed entries expire after CONFIG_CACHE_TTL like any other and are
+        then re-read one server at a time.
+        """
+        started = time.perf_counter()
+        loaded = 0
+        complete = False
+        shards = set(shard_ids) if shard_count and shard_ids is not None else None
+        try:
+            # Closed on break too, which gives the pooled connection (and its cursor) back at once
+            async with contextlib.aclosing(self.iter_server_configs(batch_size)) as rows:
+                async for server_id, prefix, music_channel, log_channel in rows:
+                    if shards is not None and (server_id >> 22) % shard_count not in shards:
+                        continue  # Discord's shard formula: served by another process
+                    if loaded >= self.cache.max_size:
+                        logger.warning(f"Settings cache is full ({self.cache.max_size} servers); remaining servers load on demand.")
+                        break
+                    self.cache.put(server_id, prefix, music_channel, log_channel)
+                    loaded += 1
                 else:
-                    return None
+                    complete = True
+        except Exception as e:
+            self._error("warm_cache", f"Error warming settings cache: {e}")
+        self._warmed = complete
+        logger.info(f"Loaded settings for {loaded} servers in {time.perf_counter() - started:.2f}s.")
+        return loaded
+
+    def cache_defaults(self, server_ids):
+        """After a complete warm_cache, caches empty settings for the given servers that have no row; returns how many.
+
+        Without this, the first lookup for each such server would still query
+        the database. Only free cache space is used, so no warmed row is evicted.
+        """
+        if not self._warmed:
+            return 0
+        missing = [server_id for server_id in server_ids if server_id not in self.cache]
+        missing = missing[:max(0, self.cache.max_size - len(self.cache))]
+        for server_id in missing:
+            self.cache.put(server_id)
+        return len(missing)
+
+    @timed("save_player_states")
+    async def save_player_states(self, states):
+        """Saves packed music player states ({server_id: bytes}, None deletes) in one batch; returns True on success."""
+        if not states:
+            return True
+        await self.connect()
+        saved = [(server_id, state) for server_id, state in states.items() if state is not None]
+        deleted = [server_id for server_id, state in states.items() if state is None]
+        try:
+            if self.database_type.lower() == "postgresql":
+                async with self.connection.acquire(timeout=self.query_timeout) as conn:
+                    async with conn.transaction():
+                        if saved:
+                            await conn.executemany(
+                                "INSERT INTO player_state (server_id, state) VALUES ($1, $2) "
+                                "ON CONFLICT (server_id) DO UPDATE SET state = $2",
+                                saved,
+                                timeout=self.query_timeout,
+                            )
+                        if deleted:
+                            await conn.execute(
+                                "DELETE FROM player_state WHERE server_id = ANY($1::BIGINT[])",
+                                deleted,
+                                timeout=self.query_timeout,
+                            )
+            elif self.database_type.lower() == "mongodb":
+                from pymongo import DeleteOne, ReplaceOne
+
+                operations = [
+                    ReplaceOne({"server_id": server_id}, {"server_id": server_id, "state": state}, upsert=True)
+                    for server_id, state in saved
+                ]
+                operations.extend(DeleteOne({"server_id": server_id}) for server_id in deleted)
+                await self._mongo(self.db.player_state.bulk_write(operations, ordered=False))
+            else:
+                return False
+            return True
+        except Exception as e:
+            self._error("save_player_states", f"Error saving player state: {e}")
+            return False
+
+    @timed("load_player_states")
+    async def load_player_states(self):
+        """Returns every saved music player state as {server_id: bytes}, in one read."""
+        await self.connect()
+        try:
+            if self.database_type.lower() == "postgresql":
+                async with self.connection.acquire(timeout=self.query_timeout) as conn:
+                    rows = await conn.fetch("SELECT server_id, state FROM player_state", timeout=self.query_timeout)
+                return {row["server_id"]: bytes(row["state"]) for row in rows}
+            elif self.database_type.lower() == "mongodb":
+                documents = await self._mongo(self.db.player_state.find({}, {"_id": 0}).to_list(None))
+                return {document["server_id"]: bytes(document["state"]) for document in documents}
+        except Exception as e:
+            self._error("load_player_states", f"Error loading player state: {e}")
+        return {}
+
+    @timed("load_prefix_initials")
+    async def load_prefix_initials(self):
+        """Loads the first character of every stored prefix into the cache."""
+        if not self.database_url:
+            return self.cache.prefix_initials
+        await self.connect()
+        if self.database_type.lower() == "postgresql":
+            try:
+                async with self.connection.acquire(timeout=self.query_timeout) as conn:
+                    rows = await conn.fetch(
+                        "SELECT DISTINCT LEFT(prefix, 1) FROM servers WHERE prefix IS NOT NULL AND prefix <> ''",
+                        timeout=self.query_timeout,
+                    )
+                self.cache.prefix_initials = {row[0] for row in rows}
             except Exception as e:
-                print(f"Error getting prefix: {e}")
-                return None
+                self._error("load_prefix_initials", f"Error loading prefixes: {e}")
         elif self.database_type.lower() == "mongodb":
             try:
-                server_data = self.db.servers.find_one({"server_id": server_id})
-                if server_data:
-                    return server_data.get("prefix")
-                else:
-                    return None
+                cursor = self.db.servers.aggregate([
+                    {"$match": {"prefix": {"$type": "string", "$ne": ""}}},
+                    {"$group": {"_id": {"$substrCP": ["$prefix", 0, 1]}}},
+                ])
+                rows = await self._mongo(cursor.to_list(length=None))
+                self.cache.prefix_initials = {row["_id"] for row in rows}
             except Exception as e:
-                print(f"Error getting prefix: {e}")
-                return None
+                self._error("load_prefix_initials", f"Error loading prefixes: {e}")
+        return self.cache.prefix_initials
 
-    def set_server_channel(self, server_id, action, channel_id):
+    @timed("set_server_channel")
+    async def set_server_channel(self, server_id, action, channel_id):
         """Sets a specific channel for bot actions (e.g., music playback)."""
+        action = action.lower()
+        if action not in CHANNEL_ACTIONS:
+            logger.error(f"Error setting {action} channel: unknown action")
+            return
+        if self.write_behind:
+            await self._queue_write(server_id, **{f"{action}_channel": channel_id})
+            logger.debug(f"{action.capitalize()} channel set for server {server_id}: {channel_id}")
+            return
+        await self.connect()
         if self.database_type.lower() == "postgresql":
             try:
-                self.cursor.execute(
-                    f"UPDATE servers SET {action}_channel = %s WHERE server_id = %s",
-                    (channel_id, server_id),
+                await self._execute(
+                    f"INSERT INTO servers (server_id, {action}_channel) VALUES ($1, $2) "
+                    f"ON CONFLICT (server_id) DO UPDATE SET {action}_channel = $2",
+                    server_id, channel_id,
                 )
-                self.connection.commit()
-                print(f"{action.capitalize()} channel set for server {server_id}: {channel_id}")
+                self._written(server_id, **{f"{action}_channel": channel_id})
+                logger.debug(f"{action.capitalize()} channel set for server {server_id}: {channel_id}")
             except Exception as e:
-                print(f"Error setting {action} channel: {e}")
+                self._error("set_server_channel", f"Error setting {action} channel: {e}", server_id)
         elif self.database_type.lower() == "mongodb":
             try:
-                self.db.servers.update_one(
+                await self._mongo(self.db.servers.update_one(
                     {"server_id": server_id},
                     {"$set": {f"{action}_channel": channel_id}},
                     upsert=True,
-                )
-                print(f"{action.capitalize()} channel set for server {server_id}: {channel_id}")
+                ))
+                self._written(server_id, **{f"{action}_channel": channel_id})
+                logger.debug(f"{action.capitalize()} channel set for server {server_id}: {channel_id}")
             except Exception as e:
-                print(f"Error setting {action} channel: {e}")
+                self._error("set_server_channel", f"Error setting {action} channel: {e}", server_id)
 
-    def get_server_channel(self, server_id, action):
+    async def get_server_channel(self, server_id, action):
         """Retrieves the channel ID for a specific action on a server."""
-        if self.database_type.lower() == "postgresql":
-            try:
-                self.cursor.execute(
-                    f"SELECT {action}_channel FROM servers WHERE server_id = %s",
-                    (server_id,),
-                )
-                result = self.cursor.fetchone()
-                if result:
-                    return result[0]
-                else:
-                    return None
-            except Exception as e:
-                print(f"Error getting {action} channel: {e}")
-                return None
-        elif self.database_type.lower() == "mongodb":
+        action = action.lower()
+        if action not in CHANNEL_ACTIONS:
+            logger.error(f"Error getting {action} channel: unknown action")
+            return None
+        try:
+            config = await self._load_server_config(server_id)
+            return getattr(config, f"{action}_channel") if config else None
+        except Exception as e:
+            self._error("get_server_channel", f"Error getting {action} channel: {e}", server_id)
+            return None
+
+    async def _queue_write(self, server_id, **fields):
+        """Buffers a settings write for the next batched flush and applies it to the cache."""
+        try:
+            # Cache the row first so reads see the buffered value before it is flushed
+            await self._load_server_config(server_id)
+        except Exception as e:
+            self._error("read_server_config", f"Error loading settings for server {server_id}: {e}", server_id)
+        self._pending.setdefault(server_id, {}).update(fields)
+        self.cache.update(server_id, **fields)
+        if len(self._pending) >= self.flush_threshold:
+            self._flush_now.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Flushes buffered writes every flush_interval seconds, or early once flush_threshold is reached."""
+        while self._pending:
             try:
-                server_data = self.db.servers.find_one({"server_id": server_id})
-                if server_data:
-                    return server_data.get(f"{action}_channel")
-                else:
-                    return None
-            except Exception as e:
-                print(f"Error getting {action} channel: {e}")
-                return None
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            # Shielded so cancelling the loop never drops a batch that is being written
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """Writes every buffered settings update in batched upserts."""
+        async with self._flush_lock:
+            if self._pending:
+                await self._flush_pending()
+
+    @timed("flush")
+    async def _flush_pending(self):
+        pending, self._pending = self._pending, {}
+        try:
+            await self.connect()
+            if self.database_type.lower() == "postgresql":
+                # One executemany per distinct set of changed columns
+                batches = {}
+                for server_id, fields in pending.items():
+                    columns = tuple(sorted(fields))
+                    batches.setdefault(columns, []).append((server_id, *(fields[column] for column in columns)))
+                async with self.connection.acquire(timeout=self.query_timeout) as conn:
+                    async with conn.transaction():
+                        for columns, rows in batches.items():
+                            placeholders = ", ".join(f"${i}" for i in range(2, len(columns) + 2))
+                            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+                            await conn.executemany(
+                                f"INSERT INTO servers (server_id, {', '.join(columns)}) VALUES ($1, {placeholders}) "
+                                f"ON CONFLICT (server_id) DO UPDATE SET {updates}",
+                                rows,
+                                timeout=self.query_timeout,
+                            )
+            elif self.database_type.lower() == "mongodb":
+                from pymongo import UpdateOne
+
+                await self._mongo(self.db.servers.bulk_write(
+                    [UpdateOne({"server_id": server_id}, {"$set": fields}, upsert=True) for server_id, fields in pending.items()],
+                    ordered=False,
+                ))
+            for server_id, fields in pending.items():
+                self._written(server_id, **fields)  # Already cached; this stops reads that raced the flush
+            logger.debug(f"Flushed settings for {len(pending)} servers.")
+        except Exception as e:
+            self._error("flush", f"Error flushing settings: {e}")
+            # Put the batch back, keeping any newer writes that arrived meanwhile
+            for server_id, fields in pending.items():
+                self._pending[server_id] = {**fields, **self._pending.get(server_id, {})}
 
-    def close_connection(self):
-        """Closes the database connection."""
+    @timed("close_connection")
+    async def close_connection(self):
+        """Flushes buffered writes and closes the database connection pool."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
         if self.connection:
             if self.database_type.lower() == "postgresql":
-                self.cursor.close()
-                self.connection.close()
-                print("PostgreSQL database connection closed.")
+                await self.connection.close()
+                logger.info("PostgreSQL database connection closed.")
             elif self.database_type.lower() == "mongodb":
                 self.connection.close()
-                print("MongoDB database connection closed.")
-
-    def __del__(self):
-        """Closes the database connection when the object is garbage collected."""
-        self.close_connection()
\ No newline at end of file
+                logger.info("MongoDB database connection closed.")
+            self.connection = None
@@ -0,0 +1,116 @@
+import os
+import json
+import base64
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DatabasePlayerStateStore:
+    """Keeps packed music player states in the configured database's player_state table."""
+
+    def __init__(self, database):
+        self.database = database
+
+    async def save(self, states):
+        """Saves {server_id: bytes} (None deletes) in one batch; returns True on success."""
+        return await self.database.save_player_states(states)
+
+    async def load(self):
+        """Returns every saved state as {server_id: bytes}."""
+        return await self.database.load_player_states()
+
+class FilePlayerStateStore:
+    """Keeps packed music player states in a local append-only JSON-lines file.
+
+    Every save appends one line per changed server and the last line for a
+    server wins. The file is rewritten with only the live entries once stale
+    lines outnumber them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._servers = set()  # Servers with a live entry in the file
+        self._lines = 0
+        self._lock = asyncio.Lock()
+
+    def _read(self):
+        states = {}
+        lines = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line from a crash mid-write
+                    if entry["state"] is None:
+                        states.pop(entry["server_id"], None)
+                    else:
+                        states[entry["server_id"]] = base64.b64decode(entry["state"])
+        except FileNotFoundError:
+            pass
+        self._servers = set(states)
+        self._lines = lines
+        return states
+
+    @staticmethod
+    def _line(server_id, state):
+        encoded = base64.b64encode(state).decode() if state is not None else None
+        return json.dumps({"server_id": server_id, "state": encoded}, separators=(",", ":")) + "\n"
+
+    def _append(self, states):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(self._line(server_id, state) for server_id, state in states.items())
+            f.flush()
+            os.fsync(f.fileno())
+        self._lines += len(states)
+        for server_id, state in states.items():
+            if state is None:
+                self._servers.discard(server_id)
+            else:
+                self._servers.add(server_id)
+        if self._lines > 2 * len(self._servers) + 1000:
+            self._compact(self._read())
+
+    def _compact(self, states):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.writelines(self._line(server_id, state) for server_id, state in states.items())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._lines = len(states)
+
+    async def save(self, states):
+        """Appends {server_id: bytes} (None deletes); returns True on success."""
+        if not states:
+            return True
+        async with self._lock:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._append, states)
+                return True
+            except OSError as e:
+                logger.error(f"Error saving player state: {e}")
+                return False
+
+    async def load(self):
+        """Returns every saved state as {server_id: bytes}, compacting the file if it has grown."""
+        async with self._lock:
+            try:
+                loop = asyncio.get_running_loop()
+                states = await loop.run_in_executor(None, self._read)
+                if self._lines > len(states):
+                    await loop.run_in_executor(None, self._compact, states)
+                return states
+            except OSError as e:
+                logger.error(f"Error loading player state: {e}")
+                return {}
+
+def create_player_state_store(database):
+    """Uses the database when one is configured (or PLAYER_STATE_STORE=database), otherwise a local file."""
+    store = os.getenv("PLAYER_STATE_STORE", "database" if database.database_url else "file").lower()
+    if store == "database":
+        return DatabasePlayerStateStore(database)
+    return FilePlayerStateStore(os.getenv("PLAYER_STATE_FILE", "player_state.jsonl"))
@@ -0,0 +1,31 @@
+class PrefixResolver:
+    """Resolves the command prefix for each message from the stored per-server prefix.
+
+    Used as ``command_prefix`` for ``commands.Bot``. Lookups go through the
+    Database's settings cache, so a cached server costs one dictionary lookup and
+    a miss is awaited on the connection pool instead of blocking the loop.
+    """
+
+    def __init__(self, database, default_prefix="!"):
+        self.database = database
+        self.default_prefix = default_prefix
+
+    async def load(self):
+        """Loads the prefix initials used by the pre-filter; until then every message is looked up."""
+        await self.database.load_prefix_initials()
+        if self.database.cache.prefix_initials is not None:
+            self.database.cache.prefix_initials.add(self.default_prefix[0])
+
+    def could_be_command(self, content):
+        """Cheap check that rejects messages which cannot start with any server's prefix."""
+        if not content:
+            return False
+        initials = self.database.cache.prefix_initials
+        return initials is None or content[0] in initials
+
+    async def __call__(self, bot, message):
+        # A message that cannot match any prefix gets the default one, which it won't match either
+        if message.guild is None or not self.could_be_command(message.content):
+            return self.default_prefix
+        prefix = await self.database.get_server_prefix(message.guild.id)
+        return prefix or self.default_prefix
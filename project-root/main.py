@@ -1,32 +1,140 @@
+import time
+
+STARTED = time.perf_counter()  # Startup is timed from before the imports below
+
+import asyncio
 import discord
 from discord.ext import commands
 import os
+import signal
 from dotenv import load_dotenv
 import logging
 
+from core import bind_command, loop_monitor, member_cache, setup_logging
+from data import database
+from data.prefix import PrefixResolver
+
 # Load environment variables from .env
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; records are written by a background thread, never on the event loop
+setup_logging()
 
 # Initialize Discord intents
 intents = discord.Intents.default()
-intents.members = True  # Enable member intents to retrieve user information
+intents.members = True  # Enable member intents to retrieve user information (MEMBER_CACHE_POLICY decides which are kept)
 intents.message_content = True  # Enable message content intents to read message content
 
-# Create bot instance
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Resolve each server's stored prefix, falling back to '!'
+prefix_resolver = PrefixResolver(database, default_prefix='!')
+
+class GracefulClose:
+    """Saves what is still in memory however the bot stops: !shutdown, Ctrl+C, or cluster.py's SIGTERM."""
+
+    async def close(self):
+        if not self.is_closed():
+            music = self.get_cog("Music")
+            if music is not None:
+                await self.remove_cog(music.qualified_name)  # Saves every music player's queue for the next start
+            await database.close_connection()  # Flushes any buffered settings writes
+        await super().close()
+
+class MusicBot(GracefulClose, commands.Bot):
+    pass
+
+class ShardedMusicBot(GracefulClose, commands.AutoShardedBot):
+    pass
+
+# Create bot instance; cluster.py runs one process per slice of shards and sets
+# SHARD_COUNT/SHARD_IDS for each, and SHARD_COUNT alone shards within this process
+if os.getenv("SHARD_COUNT"):
+    shard_ids = os.getenv("SHARD_IDS")
+    bot = ShardedMusicBot(
+        command_prefix=prefix_resolver,
+        intents=intents,
+        shard_count=int(os.getenv("SHARD_COUNT")),
+        shard_ids=[int(shard_id) for shard_id in shard_ids.split(",")] if shard_ids else None,
+        member_cache_flags=member_cache.cache_flags,
+        chunk_guilds_at_startup=member_cache.chunk_at_startup,
+    )
+else:
+    bot = MusicBot(
+        command_prefix=prefix_resolver,
+        intents=intents,
+        member_cache_flags=member_cache.cache_flags,
+        chunk_guilds_at_startup=member_cache.chunk_at_startup,
+    )
+
+# Seconds spent in each startup phase, logged once when the bot is first ready
+startup_times = {"imports": time.perf_counter() - STARTED}
+_phase_started = time.perf_counter()
+
+def _end_phase(phase):
+    global _phase_started
+    now = time.perf_counter()
+    startup_times[phase] = now - _phase_started
+    _phase_started = now
+
+async def _load_settings():
+    # Load the prefix pre-filter and the settings of this process's servers before any message arrives
+    started = time.perf_counter()
+    await asyncio.gather(
+        prefix_resolver.load(),
+        database.warm_cache(
+            batch_size=int(os.getenv("CONFIG_WARM_BATCH_SIZE", "1000")),
+            shard_count=bot.shard_count,
+            shard_ids=getattr(bot, "shard_ids", None),  # Only AutoShardedBot has them
+        ),
+    )
+    startup_times["settings"] = time.perf_counter() - started
+
+async def _load_extensions():
+    # Every .py in cogs/ is an extension; each one's setup() adds its cog
+    started = time.perf_counter()
+    for filename in sorted(os.listdir('./cogs')):
+        if filename.endswith('.py'):
+            try:
+                await bot.load_extension(f'cogs.{filename[:-3]}')
+            except Exception as e:
+                logging.error(f"Failed to load cog {filename[:-3]}: {e}")
+    startup_times["extensions"] = time.perf_counter() - started
+
+@bot.event
+async def setup_hook():
+    # Runs once, after login and before the gateway connects, so nothing here repeats on reconnects
+    _end_phase("login")
+    loop_monitor.start()  # Logs what the event loop is stuck on whenever it stalls
+    try:
+        # Ctrl+C already closes the bot; SIGTERM (how cluster.py stops a worker) would just kill it
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except NotImplementedError:
+        pass  # No loop signal handlers on Windows
+    # The settings queries are in flight while the cogs are imported
+    settings = asyncio.create_task(_load_settings())
+    await _load_extensions()
+    await settings
+    _end_phase("setup")
+
+@bot.before_invoke
+async def bind_log_context(ctx):
+    # Every record logged while the command runs carries its server and name
+    bind_command(ctx)
 
-# Load cogs
 @bot.event
 async def on_ready():
     logging.info(f'Logged in as {bot.user.name} (ID: {bot.user.id})')
-
-    # Load cogs for music, administration, and utilities
-    for filename in os.listdir('./cogs'):
-        if filename.endswith('.py'):
-            bot.load_extension(f'cogs.{filename[:-3]}')
+    if bot.shard_count:
+        logging.info(f'Cluster {os.getenv("CLUSTER_ID", "0")}: shards {bot.shard_ids or "all"} of {bot.shard_count}, {len(bot.guilds)} servers')
+    if "gateway" not in startup_times:  # on_ready fires again after every reconnect
+        _end_phase("gateway")
+        # Servers without a settings row are known once the guilds have arrived
+        database.cache_defaults(guild.id for guild in bot.guilds)
+        times = startup_times
+        logging.info(
+            f"Ready {time.perf_counter() - STARTED:.2f}s after start: imports {times['imports']:.2f}s, "
+            f"login {times['login']:.2f}s, setup {times['setup']:.2f}s (settings {times['settings']:.2f}s "
+            f"alongside cogs {times['extensions']:.2f}s), gateway {times['gateway']:.2f}s"
+        )
 
 # Run the bot
 if __name__ == '__main__':
@@ -37,4 +145,5 @@ if __name__ == '__main__':
         exit(1)
 
     # Start the bot
-    bot.run(token)
\ No newline at end of file
+    # log_handler=None keeps discord.py from adding its own handler; its records go through ours
+    bot.run(token, log_handler=None)
\ No newline at end of file